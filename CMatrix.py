@@ -1,83 +1,90 @@
 import math
 import cmath
+import numpy as np
 #Class for defining Complex Matrices
+#Values are held in a contiguous complex128 ndarray in conventional (row, column) orientation so that multiplication and tensoring
+#are handed to numpy/BLAS. The raw representation keeps the column-major convention used throughout, e.g. raw_data[column][row]
 class CMatrix:
-    #Parameter is raw 2D array of Complex values
+    #Parameter is raw 2D array of Complex values, stored column by column
     def __init__(self, init_data):
-        self.raw_data = [[0 + 0j for y in range(len(init_data[0]))] for x in range(len(init_data))]
-        for i in range(len(init_data)):
-            for j in range(len(init_data[i])):
-                self.raw_data[i][j] = init_data[i][j]
+        self.matrix = np.ascontiguousarray(np.array(init_data, dtype=np.complex128).T)
 
-    #Gets raw representation of the instance
+    #Builds a CMatrix directly from a 2D ndarray in (row, column) orientation, avoiding the column-major conversion
+    @staticmethod
+    def from_array(matrix):
+        m = CMatrix.__new__(CMatrix)
+        m.matrix = np.ascontiguousarray(matrix, dtype=np.complex128)
+        return m
+
+    #Gets raw representation of the instance. This is a column-major view of the underlying array
     def get_raw_data(self):
-        return self.raw_data
+        return self.matrix.T
+
+    #Gets the underlying (row, column) ndarray
+    def to_array(self):
+        return self.matrix
+
+    #Gets the (rows, columns) shape of the matrix
+    def get_shape(self):
+        return self.matrix.shape
+
+    #Applies the matrix to a (columns, k) ndarray of k column vectors, e.g. returns self * v
+    def apply_array(self, v):
+        return self.matrix @ v
+
+    #Multiplies a (k, rows) ndarray on the left of this matrix, e.g. returns m * self
+    def left_apply_array(self, m):
+        return m @ self.matrix
+
+    #Estimated number of multiply-adds needed to apply the matrix to a number of column vectors
+    def apply_cost(self, columns):
+        rows, cols = self.matrix.shape
+        return float(rows) * cols * columns
+
+    #Factors of the matrix when used in a tensor product
+    def get_factors(self):
+        return [self]
+
+    #Makes the matrix read-only so that it can be shared, e.g. by a cache. Returns the matrix itself
+    def freeze(self):
+        self.matrix.flags.writeable = False
+        return self
+
+    #Whether the matrix is known to be an identity, e.g. a wire, without inspecting its values
+    def is_identity(self):
+        return False
 
     #Returns string form, reading row by row
     def __str__(self):
-        raw_data = self.get_raw_data()
         s = ""
-        for j in range(len(raw_data[0])):
-            for i in range(len(raw_data)):
-                s = s + raw_data[i][j].__str__() + ","
-            if j != len(raw_data[0]) - 1:
+        rows = self.matrix.shape[0]
+        for j in range(rows):
+            for v in self.matrix[j]:
+                s = s + complex(v).__str__() + ","
+            if j != rows - 1:
                 s = s + "\n"
         return s
 
     #Override add operator to perform Matrix addition
     def __add__(self, other):
-        raw_data = self.get_raw_data()
-        other_data = other.get_raw_data()
-        new_data = [[0 + 0j for y in range(len(raw_data[0]))] for x in range(len(raw_data))]
-        for i in range(len(raw_data)):
-            for j in range(len(raw_data[i])):
-                new_data[i][j] = raw_data[i][j] + other_data[i][j]
-        return CMatrix(new_data)
+        return CMatrix.from_array(self.matrix + other.to_array())
 
     #Override subtraction operator to perform Matrix subtraction
     def __sub__(self, other):
-        raw_data = self.get_raw_data()
-        other_data = other.get_raw_data()
-        new_data = [[0 + 0j for y in range(len(raw_data[0]))] for x in range(len(raw_data))]
-        for i in range(len(raw_data)):
-            for j in range(len(raw_data[i])):
-                new_data[i][j] = raw_data[i][j] - other_data[i][j]
-        return CMatrix(new_data)
+        return CMatrix.from_array(self.matrix - other.to_array())
 
     #Returns the same matrix with all elements * -1
     def negative(self):
-        raw_data = self.get_raw_data()
-        new_data = [[0 + 0j for y in range(len(raw_data[0]))] for x in range(len(raw_data))]
-        for i in range(len(raw_data)):
-            for j in range(len(raw_data[i])):
-                new_data[i][j] = -raw_data[i][j]
-        return CMatrix(new_data)
-
-    #Performs conventional Matrix multiplication
+        return CMatrix.from_array(-self.matrix)
+
+    #Performs conventional Matrix multiplication. The right hand side multiplies itself in so that structured operators
+    #(see StructuredMatrix.py) are never densified
     def __mul__(self, other):
-        raw_data = self.get_raw_data()
-        other_data = other.get_raw_data()
-        new_data = [[0 + 0j for y in range(len(raw_data[0]))] for x in range(len(other_data))]
-        for j in range(len(raw_data[0])):
-            for i in range(len(other_data)):
-                for k in range(len(raw_data)):
-                    new_data[i][j] += raw_data[k][j] * other_data[i][k]
-        return CMatrix(new_data)
+        return CMatrix.from_array(other.left_apply_array(self.matrix))
 
     #Tensor operator
     def tensor(self, other):
-        raw_data = self.get_raw_data()
-        other_data = other.get_raw_data()
-        other_width = len(other_data)
-        other_height = len(other_data[0])
-        new_data = [[0 + 0j for y in range(len(raw_data[0]) * other_height)] for x in range(len(raw_data) * other_width)]
-
-        for i in range(len(raw_data)):
-            for j in range(len(raw_data[0])):
-                for k in range(other_width):
-                    for l in range(other_height):
-                        new_data[(i * other_width) + k][(j * other_height) + l] = raw_data[i][j] * other_data[k][l]
-        return CMatrix(new_data)
+        return CMatrix.from_array(np.kron(self.matrix, other.to_array()))
 
     #Optional: Tensor can be used with division operator
     def __truediv__(self,other):
@@ -85,28 +92,14 @@ class CMatrix:
 
     #Returns a quantum normalization of the matrix e.g. one that has a probability sum of 1
     def normalize(self):
-        raw_data = self.get_raw_data()
-        new_data = [[0 + 0j for y in range(len(raw_data[0]))] for x in range(len(raw_data))]
-        sum = 0 
-        for i in range(len(raw_data)):
-            for j in range(len(raw_data[i])):
-                sum += ((raw_data[i][j].real * raw_data[i][j].real) + (raw_data[i][j].imag * raw_data[i][j].imag))
-        sq_sum = math.sqrt(sum)
-        for i in range(len(raw_data)):
-            for j in range(len(raw_data[i])):
-                if sq_sum != 0:
-                    new_data[i][j] = raw_data[i][j] / sq_sum
-        return CMatrix(new_data)
+        sq_sum = np.linalg.norm(self.matrix)
+        if sq_sum == 0:
+            return CMatrix.from_array(np.zeros_like(self.matrix))
+        return CMatrix.from_array(self.matrix / sq_sum)
 
     #Returns the realized square root of the sum of the matrix
     def size(self):
-        raw_data = self.get_raw_data()
-        sum = 0.0
-        for i in range(len(raw_data)):
-            for j in range(len(raw_data[i])):
-                sum += (raw_data[i][j].real * raw_data[i][j].real) + (raw_data[i][j].imag * raw_data[i][j].imag)
-        sq_sum = math.sqrt(sum)
-        return sq_sum
+        return float(np.linalg.norm(self.matrix))
 
 
 a = CMatrix([[0.707 + 0j,0.707 + 0j,0 + 0j,0 + 0j]])
@@ -1,13 +1,25 @@
 from QuantumSystem import *
 from CMatrix import *
+import numpy as np
 import random
 
 #Super class declaring key method
 class Check_Builder:
-    #Initialize method
+    #Version of the current checks. Each initialize gives a new version, unique across check builders, so that results cached against
+    #older checks (see Experiment.run_1_plus_lambda) are never reused
+    version = 0
+    versions = 0
+
+    #Initialize method. Subclasses call this to take a new version
     def initialize(self, checks):
+        Check_Builder.versions += 1
+        self.version = Check_Builder.versions
         return None
 
+    #Gets the version of the current checks
+    def get_version(self):
+        return self.version
+
     #Evaluation method
     def get_error(self, qsystem):
         return 0.0
@@ -30,9 +42,13 @@ class IO_Check(Check_Builder):
         self.in_checks = []
         self.out_checks = []
         self.checks = 0
+        #The check inputs and expected outputs stacked as the columns of two (2^n, checks) ndarrays
+        self.in_matrix = None
+        self.out_matrix = None
 
     #Build IO Pairs for a given number of checks
     def initialize(self, checks):
+        Check_Builder.initialize(self, checks)
         self.checks = checks
         self.in_checks = []
         self.out_checks = []
@@ -40,6 +56,8 @@ class IO_Check(Check_Builder):
             IO_pair = self.initialize_io_pair()
             self.in_checks += [IO_pair[0]]
             self.out_checks += [IO_pair[1]]
+        self.in_matrix = np.stack([s.state_data.to_array()[:, 0] for s in self.in_checks], axis=1)
+        self.out_matrix = np.stack([s.state_data.to_array()[:, 0] for s in self.out_checks], axis=1)
         
     #Generate a IO pair
     def initialize_io_pair(self):
@@ -56,7 +74,23 @@ class IO_Check(Check_Builder):
         return [in_state, out_state]
 
     #Evaluate by calculating total error across checks and averaging
+    #Every check is evaluated at once: the system is applied to in_matrix in one product, and the columns are normalised and compared
+    #with out_matrix together. Systems with measurement layers are evaluated check by check (see get_error_by_check)
     def get_error(self, qsystem):
+       real = qsystem.apply_states(self.in_matrix)
+       if real is None:
+           return self.get_error_by_check(qsystem)
+
+       #ZXGraphs may be trace reducing, so we normalize them to have a square sum of 1, leaving zero columns as zero (see CMatrix.normalize)
+       norms = np.linalg.norm(real, axis=0)
+       real = real / np.where(norms == 0, 1.0, norms)
+
+       #Sum the errors that are 'significant', > 0.000000001
+       errors = np.linalg.norm(real - self.out_matrix, axis=0)
+       return sum(errors[errors > 0.000000001].tolist()) / float(self.checks)
+
+    #Evaluate one check at a time
+    def get_error_by_check(self, qsystem):
        #initialize error counter
        error = 0.0
 
@@ -79,179 +113,92 @@ class IO_Check(Check_Builder):
        return error / float(self.checks)
 
 #Check builder specific for Teleportation Problem
+#The system is expected to have an operator layer on the input qubit and 2 zero qubits, a measurement of qubits 0 and 1 and a final operator
+#layer. Each check is scored by the expected error over the 4 measurement outcomes (branches), each branch's output being compared with
+#the input teleported to qubit 2 under the closest of the 4 basis states left on qubits 0 and 1 (prefixes)
 class TP_Check(Check_Builder):
     #Init code
     def __init__(self):
         self.in_checks = []
         self.checks = 0
+        #The check inputs with 2 extra qubits in zero state, and the outputs expected under each prefix, as columns of (8, checks) ndarrays
+        self.in_matrix = None
+        self.targets = None
 
     #Build IO Pairs for a given number of checks
     def initialize(self, checks):
+        Check_Builder.initialize(self, checks)
         self.checks = checks
         self.in_checks = []
         #Simply generate single qubits as input
         for i in range(checks):
             self.in_checks += [Check_Builder.gen_qubit()]
-    
-    #Evaluate by calculating total error across checks and averaging
-    def get_error(self, qsystem):
-       #initialize error counter
-       error = 0.0
-
-       #Initialize zero qubit
-       z = CMatrix([[1 + 0j, 0j]])
-       o = CMatrix([[0j, 1 + 0j]])
-       #Initialize one qubit
-
-       #Evaluate on each check
-       for check in range(self.checks):
-            #Get check input
-            inp = self.in_checks[check]
-
-            #Build input with 2 extra qubits in zero state
-            input_state = QState((inp / z / z).get_raw_data()[0])
-            
-            #Evaluate system on check to generate *PRE-MEASUREMENT STATE*
-            inter = input_state.apply_operator(qsystem.compiled_system.get_layer(0))
-            inter.normalize()
-            
-            #Initialize arbitrarily large
-            first = None
-            second = None
-            #Calculate expected error
-            expected_error = 0.0
-            #Try each pairing of the first 2 qubits (e.g. the control bits that are measured and passed)
-            pairings = []
-            for one1 in [False, True]:
-                for one2 in [False, True]:
-                    copy = inter.copy()
-                    res = None
-                    if one1:
-                        res = inter.measure_qubit_to_value(0, False)
-                    else:
-                        res = inter.measure_qubit_to_value(0, True)
-                    inter2 = res[0]
-                    res2 = None
-                    if one2:
-                        res2 = inter2.measure_qubit_to_value(1, False)
-                    else:
-                        res2 = inter2.measure_qubit_to_value(1, True)
-                    p = res[1] * res2[1]
-                    real = res2[0]
-                    real = real.apply_operator(qsystem.compiled_system.get_layer(2))
-                    real.normalize()
-                    
-                    #Find best case error
-                    min_error = 10000.0
-                    for one3 in [False, True]:
-                        for one4 in [False, True]:
-                            if one3:
-                                first = o
-                            else:
-                                first = z
-                            if one4:
-                                second = o
-                            else:
-                                second = z
-                            output_state = QState((first / second / inp).get_raw_data()[0])
-                            potential_error = (real - output_state).state_data.size()
-                            if potential_error < min_error:
-                                min_error = potential_error
-                    pairings.append([min_error, p])
-            totalp = 0.0
-            for pair in pairings:
-                totalp += pair[1]
-                expected_error += (pair[1] * pair[0])
-            if totalp <= 0.0001:
-                expected_error = 1.0
-            #Ignore insignificant error e.g. caused by python math
-            if expected_error > 0.000000001:
-                error += expected_error
-       return error / float(self.checks)
-
+        qubits = np.stack([inp.to_array()[:, 0] for inp in self.in_checks], axis=1)
+        #Qubit 0 is the most significant, so the input fills rows 000 and 100
+        self.in_matrix = np.zeros((8, checks), dtype=np.complex128)
+        self.in_matrix[0::4] = qubits
+        #Prefix c leaves qubits 0 and 1 in basis state c, with the input on qubit 2
+        self.targets = np.zeros((4, 8, checks), dtype=np.complex128)
+        for c in range(4):
+            self.targets[c, 2 * c:2 * (c + 1)] = qubits
 
     #Evaluate by calculating total error across checks and averaging
+    #Every check, branch and prefix is evaluated at once: the pre-measurement states of all checks are one product, the 4 branches of
+    #each are projections of it (see QState.measure_qubit_branches) which go through the final layer in a second product, and every branch
+    #is compared with every prefix. debug prints each check's working as it goes
+    def get_error(self, qsystem, debug=False):
+       checks = self.checks
+
+       #Evaluate system on checks to generate *PRE-MEASUREMENT STATES*, normalising each
+       inter = qsystem.compiled_system.get_layer(0).apply_array(self.in_matrix)
+       inter = TP_Check.normalize_columns(inter)
+
+       #Probability of each branch (measuring qubits 0 and 1 as basis state b) is the square sum of its 2 amplitudes
+       weights = (inter.real ** 2 + inter.imag ** 2).reshape(4, 2, checks).sum(axis=1)
+       totals = weights.sum(axis=0)
+       p = weights / np.where(totals == 0, 1.0, totals)
+
+       #Project onto each branch, giving (8, branch, check) states, then apply the final layer to all of them
+       projected = np.zeros((8, 4, checks), dtype=np.complex128)
+       for b in range(4):
+           projected[2 * b:2 * (b + 1), b] = inter[2 * b:2 * (b + 1)]
+       real = qsystem.compiled_system.get_layer(2).apply_array(projected.reshape(8, 4 * checks))
+       real = TP_Check.normalize_columns(real).reshape(8, 4, checks)
+
+       #Error of every branch against every prefix, keeping the best prefix
+       errors = np.linalg.norm(real[None, :, :, :] - self.targets[:, :, None, :], axis=1)
+       min_errors = errors.min(axis=0)
+
+       #Expected error over the branches
+       totalp = p.sum(axis=0)
+       expected_errors = (p * min_errors).sum(axis=0)
+       expected_errors[totalp <= 0.0001] = 1.0
+
+       if debug:
+           TP_Check.print_debug(self.in_matrix, inter, real, p, errors, expected_errors)
+
+       #Ignore insignificant error e.g. caused by python math
+       return sum(expected_errors[expected_errors > 0.000000001].tolist()) / float(checks)
+
+    #Evaluate by calculating total error across checks and averaging, printing the working of each check
     def get_error_debug(self, qsystem):
-       #initialize error counter
-       error = 0.0
+       return self.get_error(qsystem, True)
 
-       #Initialize zero qubit
-       z = CMatrix([[1 + 0j, 0j]])
-       o = CMatrix([[0j, 1 + 0j]])
-       #Initialize one qubit
-
-       #Evaluate on each check
-       for check in range(self.checks):
-            #Get check input
-            inp = self.in_checks[check]
-
-            #Build input with 2 extra qubits in zero state
-            input_state = QState((inp / z / z).get_raw_data()[0])
-            print("Input state: \n" + str(input_state))
-            #Evaluate system on check to generate *PRE-MEASUREMENT STATE*
-            inter = input_state.apply_operator(qsystem.compiled_system.get_layer(0))
-            inter.normalize()
-            print("Has pre-measurement state: \n" + str(inter))
-            #Increment error if it is 'significant', > 0.000000001.
-            #Initialize arbitrarily large
-            first = None
-            second = None
-            #Calculate expected error
-            expected_error = 0.0
-            #Try each pairing of the first 2 qubits (e.g. the control bits that are measured and passed)
-            pairings = []
-            for one1 in [False, True]:
-                for one2 in [False, True]:
-                    copy = inter.copy()
-                    res = None
-                    if one1:
-                        res = inter.measure_qubit_to_value(0, False)
-                    else:
-                        res = inter.measure_qubit_to_value(0, True)
-                    inter2 = res[0]
-                    res2 = None
-                    if one2:
-                        res2 = inter2.measure_qubit_to_value(1, False)
-                    else:
-                        res2 = inter2.measure_qubit_to_value(1, True)
-                    p = res[1] * res2[1]
-                    real = res2[0]
-                    real = real.apply_operator(qsystem.compiled_system.get_layer(2))
-                    real.normalize()
-
-                    print("Possible result from " + str(one1) + "," + str(one2) + ", p = " + str(p) + ":\n" + str(real))
+    #Normalises each column of an ndarray to have a square sum of 1, leaving zero columns as zero (see CMatrix.normalize)
+    @staticmethod
+    def normalize_columns(states):
+       norms = np.linalg.norm(states, axis=0)
+       return states / np.where(norms == 0, 1.0, norms)
 
-                    #Find best case error
-                    min_error = 10000.0
-                    for one3 in [False, True]:
-                        for one4 in [False, True]:
-                            if one3:
-                                first = o
-                            else:
-                                first = z
-                            if one4:
-                                second = o
-                            else:
-                                second = z
-                            output_state = QState((first / second / inp).get_raw_data()[0])
-                            print("Error matrix: \n" + str(real - output_state))
-                            potential_error = (real - output_state).state_data.size()
-                            print("Error: " + str(potential_error))
-                            if potential_error < min_error:
-                                min_error = potential_error
-                    print("Min error: " + str(min_error))
-                    print("With probability: " + str(p))
-                    pairings.append([min_error, p])
-            totalp = 0.0
-            for pair in pairings:
-                print(pair)
-                totalp += pair[1]
-                expected_error += (pair[1] * pair[0])
-            print("Total probability: " + str(totalp))
-            if totalp <= 0.0001:
-                expected_error = 1.0
-            print("Expected error: " + str(expected_error))
-            #Ignore insignificant error e.g. caused by python math
-            if expected_error > 0.000000001:
-                error += expected_error
-       return error / float(self.checks)
+    #Prints the working of get_error for each check
+    @staticmethod
+    def print_debug(inputs, inter, real, p, errors, expected_errors):
+       for check in range(inputs.shape[1]):
+           print("Input state: \n" + str(inputs[:, check]))
+           print("Has pre-measurement state: \n" + str(inter[:, check]))
+           for b in range(4):
+               print("Possible result from " + str(b >= 2) + "," + str(b % 2 == 1) + ", p = " + str(p[b, check]) + ":\n" + str(real[:, b, check]))
+               print("Errors by prefix: " + str(errors[:, b, check]))
+               print("Min error: " + str(errors[:, b, check].min()))
+           print("Total probability: " + str(p[:, check].sum()))
+           print("Expected error: " + str(expected_errors[check]))
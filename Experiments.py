@@ -1,54 +1,82 @@
 from Individual_Builders import *
 from Check_Builders import *
+from LRUCache import LRU_Cache
+from ParallelEvaluation import *
+from Islands import *
+import pickle
+import os
+import copy
+import multiprocessing
+import queue
 class Experiment:
 
+    #Scores are cached by the phenotypes of an individual's parts and the version of the checks (see ZX_CGP.get_phenotype and
+    #Check_Builder.get_version), so offspring whose mutations leave the phenotype unchanged or return to a known one are not rebuilt
+    #fitness_cache_size bounds the number of cached scores
+    #processes is the number of worker processes offspring are built and scored on (see ParallelEvaluation.py), 1 scoring them in this
+    #process. Every offspring is scored before the winner is chosen and scores depend only on the genomes, so selection is the same either
+    #way (see check_determinism)
+    #island optionally makes the run one island of an island model (see run_islands): immigrants replace offspring after repopulation,
+    #and the run finishes early once another island reaches the target
+    #If checkpoint_path is given the run's state is saved there every checkpoint_interval generations (see save_checkpoint), and a run
+    #killed part way can be continued from its last checkpoint with resume
     @staticmethod
-    def run_1_plus_lambda(popsize, check_reset, init_pop_mutations, individual_builder, phase_reset_granularity, mean_mutations, variance_mutations, variance_phase, mutation_weights, max_runs, checks, check_builder, target_score):
-        #Start with gen counter at zero
-        gen = 0
-        ui_count = 0
+    def run_1_plus_lambda(popsize, check_reset, init_pop_mutations, individual_builder, phase_reset_granularity, mean_mutations, variance_mutations, variance_phase, mutation_weights, max_runs, checks, check_builder, target_score, fitness_cache_size=10000, processes=1, island=None, checkpoint_path=None, checkpoint_interval=1000, checkpoint=None):
         ui_reset = 100
-        check_count = 1
-
-        #Score counters are in a double array
-        scores = [0.0 for i in range(popsize)]
-
-        #Initialize and randomize population
-        population = [individual_builder.initialize_individual() for x in range(popsize)]
-
-        for ind in population:
-            for sbgraph in range(len(ind)):
-                for i in range(init_pop_mutations):
-                    sbgraph_copy = ind[sbgraph].copy()
-                    sbgraph_copy.mutate_with_weights(1, variance_phase, phase_reset_granularity, mutation_weights)
-                    while not sbgraph_copy.check_complexity():
-                        sbgraph_copy = ind[sbgraph].copy()
-                        sbgraph_copy.mutate_with_weights(1, variance_phase, phase_reset_granularity, mutation_weights)
-                    ind[sbgraph] = sbgraph_copy
-                    
-        #Initialize check builder with given number of checks
-        check_builder.initialize(checks)
 
-        #Evaluation counter
-        evals = 0
+        if checkpoint is None:
+            #Start with gen counter at zero
+            gen = 0
+            ui_count = 0
+            check_count = 1
 
-        #Flag for a perfect solution
-        perfect = False
+            #Score counters are in a double array
+            scores = [0.0 for i in range(popsize)]
+
+            #Initialize and randomize population
+            population = [individual_builder.initialize_individual() for x in range(popsize)]
+
+            #Mutations are bounded: one which would exceed a part's complexity limit is undone in place and redrawn (see ZX_CGP.mutate_with_weights)
+            for ind in population:
+                for sbgraph in range(len(ind)):
+                    ind[sbgraph].mutate_with_weights(init_pop_mutations, variance_phase, phase_reset_granularity, mutation_weights, True)
+
+            #Initialize check builder with given number of checks
+            check_builder.initialize(checks)
+
+            #Evaluation counter
+            evals = 0
 
-        #Variable for tracking winner
-        winner = -1
+            #Scores of evaluated phenotypes
+            fitness_cache = LRU_Cache(fitness_cache_size)
 
-        #Variable for tracking best score in each generation
-        best = 0.0
+            #Variable for tracking winner
+            winner = -1
 
-        neutral = 0
-        same_winner = 0
-        unchanged = 0
+            #Variable for tracking best score in each generation
+            best = 0.0
+
+            neutral = 0
+            same_winner = 0
+            unchanged = 0
+
+            mutation_counters = [0 for x in range(6)]
+        else:
+            #Continue from a checkpoint. The builders, holding the checks, are among the run's parameters (see resume)
+            gen, ui_count, check_count, scores, evals, winner, best, neutral, same_winner, unchanged, mutation_counters = checkpoint["counters"]
+            population = [[Experiment.restore_part(part) for part in ind] for ind in checkpoint["population"]]
+            fitness_cache = checkpoint["fitness_cache"]
+            Check_Builder.versions = checkpoint["check_versions"]
+            random.setstate(checkpoint["random"])
+
+        #Scores offspring, on a pool of worker processes if processes > 1
+        evaluator = Parallel_Evaluator(individual_builder, check_builder, processes)
 
-        mutation_counters = [0 for x in range(6)]
+        #Flag for a perfect solution
+        perfect = False
 
         #Begin evolutionary algorithm
-        while gen < max_runs and not perfect:
+        while gen < max_runs and not perfect and (island is None or not island.stopped()):
             gen += 1
             ui_count += 1
             check_count += 1
@@ -59,6 +87,10 @@ class Experiment:
                 print(str(unchanged) + " unchanged individuals")
                 print(str(same_winner) + " stagnant generations")
                 print("Mutation distribution: " + str(mutation_counters))
+                print(str(fitness_cache))
+                reuse = individual_builder.get_layer_reuse()
+                print("Reused layers: " + str(reuse[0]) + " of " + str(reuse[1]))
+                print("Part operators: " + str(individual_builder.get_part_cache()))
                 unchanged = 0
                 neutral = 0
                 same_winner = 0
@@ -72,7 +104,13 @@ class Experiment:
                         part.changed = True
             best = 0.0
 
-            #Evaluation each individual
+            #Evaluation each individual. Individuals whose phenotypes need scoring are gathered and scored together, then every score
+            #is filled in in order
+            pending = []
+            pending_keys = {}
+            #Key of each individual waiting on a pending score, and whether each individual changed
+            keys = [None for i in range(popsize)]
+            changed_flags = [False for i in range(popsize)]
             for i in range(popsize):
                 #Get each individual
                 ind = population[i]
@@ -85,25 +123,31 @@ class Experiment:
                 if not changed:
                     unchanged += 1
                     scores[i] = scores[winner]
+                changed_flags[i] = changed
                 if changed:
-                    #Use builder to generate quantum system equivalent (QSystem from QuantumSystem.py)
-                    q = individual_builder.build_qsystem(ind)
-
-                    #Increment evaluation counter
-                    evals += 1
-
-                    #calculate error
-                    error = check_builder.get_error(q)
-
-                    inactive = 0.0
-                    #Count inactive inputs
-                    for part in range(len(ind)):
-                        inactive += float(ind[part].count_inactive_inputs())
+                    #Look the phenotype up against the current checks
+                    key = (tuple([part.get_phenotype() for part in ind]), check_builder.get_version())
+                    if key in pending_keys:
+                        keys[i] = key
+                    else:
+                        score = fitness_cache.get(key)
+                        if score is None:
+                            keys[i] = key
+                            pending_keys[key] = len(pending)
+                            pending.append(ind)
+                        scores[i] = score
+
+            #Use builder to generate quantum system equivalents (QSystem from QuantumSystem.py) and calculate their scores
+            pending_scores = evaluator.evaluate(pending)
+            #Increment evaluation counter
+            evals += len(pending)
 
-                    #Update score with mean of error, and penalize for inactive inputs
-                    scores[i] = 1.0 / (1.0 + inactive + error)
-                    if scores[i] > target:
-                        perfect = True
+            for i in range(popsize):
+                if keys[i] is not None:
+                    scores[i] = pending_scores[pending_keys[keys[i]]]
+                    fitness_cache.put(keys[i], scores[i])
+                if changed_flags[i] and scores[i] > target_score:
+                    perfect = True
 
                 #Catch generations with no positive improvement (neutral mutations win)
                 if scores[i] > best:
@@ -148,28 +192,172 @@ class Experiment:
                             #Mutate the copied part a precalculated number of times
 
                             #Round gaussian to get number of mutations
-                            mutations = int(round(gauss(uM, vM)))
+                            mutations = int(round(gauss(mean_mutations, variance_mutations)))
 
                             #Ensure mutations is positive
                             if mutations <= 0:
                                 mutations = 1
                                 
-                            counters = population[i][part].mutate_with_weights(mutations, variance_phase, phase_reset_granularity, mutation_weights)
+                            #Mutations exceeding the complexity limit are undone and redrawn as they happen, so the part stays valid
+                            counters = population[i][part].mutate_with_weights(mutations, variance_phase, phase_reset_granularity, mutation_weights, True)
 
-                            #Keep retrying until run valid complexity
-                            while not population[i][part].check_complexity():
-                                population[i][part] = population[winner][part].copy()
-                                population[i][part].changed = False
-                                counters = population[i][part].mutate_with_weights(mutations, variance_phase, phase_reset_granularity, mutation_weights)
-                                
                             for j in range(6):
                                 mutation_counters[j] += counters[j]
                     else:
                         for part in population[i]:
                             part.changed = False
+
+                #Immigrants take the places of the last offspring, to be scored with the rest next generation
+                if island is not None:
+                    slots = [i for i in range(popsize) if i != winner]
+                    for immigrant in island.migrate(gen, population[winner])[:len(slots)]:
+                        population[slots.pop()] = immigrant
+
+            #Save the state at the end of the generation
+            if checkpoint_path is not None and checkpoint_interval > 0 and gen % checkpoint_interval == 0 and not perfect:
+                parameters = [popsize, check_reset, init_pop_mutations, individual_builder, phase_reset_granularity, mean_mutations, variance_mutations, variance_phase, mutation_weights, max_runs, checks, check_builder, target_score, fitness_cache_size, processes]
+                counters = [gen, ui_count, check_count, scores, evals, winner, best, neutral, same_winner, unchanged, mutation_counters]
+                Experiment.save_checkpoint(checkpoint_path, parameters, counters, population, fitness_cache)
+        evaluator.close()
+        if island is not None and perfect:
+            island.finish()
         #Return is [final_result, score, generations, evaluations]
         print("Final winner index... " + str(winner))
         return [population[winner], scores[winner], gen, evals]
+
+    #Checks that scoring offspring on worker processes does not change a run: the run is made with seed once in this process and once on
+    #processes workers, each with its own copy of the builders, and the scores, generations, evaluations and winners (see
+    #ZX_CGP.get_layout) must match. args are run_1_plus_lambda's parameters up to fitness_cache_size. Returns whether the runs match
+    @staticmethod
+    def check_determinism(seed, processes, args):
+        runs = []
+        for workers in [1, processes]:
+            random.seed(seed)
+            run_args = copy.deepcopy(args)
+            result = Experiment.run_1_plus_lambda(*run_args, processes=workers)
+            runs.append([[part.get_layout() for part in result[0]], result[1], result[2], result[3]])
+        if runs[0] != runs[1]:
+            print("Warning! Runs on " + str(processes) + " processes differ from the run in this process!")
+            return False
+        return True
+
+    #Saves a run's state to path: its parameters, including the builders and so the checks, counters, population, fitness cache and the
+    #state of the random number generator, so that resume continues the run exactly as if it had not stopped. The operator and product
+    #caches are not saved: their entries are built from their keys alone, so a resumed run rebuilds the same operators. Parts are saved as
+    #their genomes (see ZX_Genome.py) with their changed flags
+    #The checkpoint is written to a temporary file which then replaces path, so a run killed while saving keeps its last checkpoint
+    @staticmethod
+    def save_checkpoint(path, parameters, counters, population, fitness_cache):
+        checkpoint = {
+            "parameters": parameters,
+            "counters": counters,
+            "population": [[[part.get_genome(), part.changed] for part in ind] for ind in population],
+            "fitness_cache": fitness_cache,
+            "check_versions": Check_Builder.versions,
+            "random": random.getstate()
+        }
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump(checkpoint, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    #Rebuilds a part saved by save_checkpoint
+    @staticmethod
+    def restore_part(saved):
+        part = ZX_CGP.from_genome(saved[0])
+        part.changed = saved[1]
+        return part
+
+    #Continues a run from the checkpoint at path, carrying on checkpointing to it. max_runs optionally replaces the run's generation limit
+    #Return is as for run_1_plus_lambda
+    @staticmethod
+    def resume(path, max_runs=None, checkpoint_interval=1000, processes=None):
+        with open(path, "rb") as f:
+            checkpoint = pickle.load(f)
+        parameters = list(checkpoint["parameters"])
+        if max_runs is not None:
+            parameters[9] = max_runs
+        if processes is not None:
+            parameters[14] = processes
+        return Experiment.run_1_plus_lambda(*parameters, checkpoint_path=path, checkpoint_interval=checkpoint_interval, checkpoint=checkpoint)
+
+    #Seconds run_islands waits for a result before checking whether the islands are still running
+    island_timeout = 5.0
+
+    #Island model: islands 1 + lambda populations evolve in their own processes, each run as run_1_plus_lambda with the remaining
+    #parameters, sending their winners along the topology (see Island.topology_targets) every migration_interval generations
+    #Each island has its own checks. Islands stop when one reaches the target score or all have run max_runs generations
+    #seed optionally seeds the islands' random number generators (island j with seed * islands + j), otherwise they are seeded afresh
+    #Return is [final_result, score, generations, evaluations] of the island with the best score, evaluations being totalled over every island
+    #which finished, or None if none did
+    @staticmethod
+    def run_islands(islands, migration_interval, topology, popsize, check_reset, init_pop_mutations, individual_builder, phase_reset_granularity, mean_mutations, variance_mutations, variance_phase, mutation_weights, max_runs, checks, check_builder, target_score, fitness_cache_size=10000, seed=None):
+        context = multiprocessing.get_context("fork")
+        inboxes = [context.Queue() for j in range(islands)]
+        results = context.Queue()
+        stop = context.Event()
+        targets = Island.topology_targets(topology, islands)
+        args = [popsize, check_reset, init_pop_mutations, individual_builder, phase_reset_granularity, mean_mutations, variance_mutations, variance_phase, mutation_weights, max_runs, checks, check_builder, target_score, fitness_cache_size]
+        workers = []
+        for j in range(islands):
+            island = Island(j, inboxes, targets[j], migration_interval, stop)
+            workers.append(context.Process(target=Experiment.run_island, args=(island, results, None if seed is None else (seed * islands) + j, args)))
+            workers[j].start()
+        #Results must be taken before the processes are joined, as they wait for them to be taken
+        finished = Experiment.collect_island_results(results, workers, stop)
+        for worker in workers:
+            worker.join()
+        if len(finished) == 0:
+            return None
+        evals = 0
+        best = None
+        for result in finished:
+            evals += result[3]
+            if best is None or result[1] > best[1]:
+                best = result
+        print("Best island... " + str(best[4]))
+        return [[ZX_CGP.from_genome(genome) for genome in best[0]], best[1], best[2], evals]
+
+    #Takes the results of the islands' processes as they finish, waiting at most island_timeout seconds at a time so that an island which
+    #died without putting its result is noticed. A dead island is reported and the others are stopped, and the results of the islands
+    #which finished are returned
+    @staticmethod
+    def collect_island_results(results, workers, stop):
+        finished = []
+        reported = set()
+        while len(finished) + len(reported) < len(workers):
+            try:
+                finished.append(results.get(timeout=Experiment.island_timeout))
+                continue
+            except queue.Empty:
+                pass
+            done = set(result[4] for result in finished)
+            for j in range(len(workers)):
+                if j in done or j in reported or workers[j].is_alive():
+                    continue
+                #A process which exits normally has already put its result, so it is taken before its exit is treated as a failure
+                try:
+                    finished.append(results.get(timeout=Experiment.island_timeout))
+                    break
+                except queue.Empty:
+                    print("Warning! Island " + str(j) + " exited with code " + str(workers[j].exitcode) + " without a result, stopping the islands")
+                    reported.add(j)
+                    stop.set()
+        return finished
+
+    #Runs in an island's process, putting [winner genomes, score, generations, evaluations, island index] in results
+    @staticmethod
+    def run_island(island, results, seed, args):
+        if seed is None:
+            random.seed()
+        else:
+            random.seed(seed)
+        result = Experiment.run_1_plus_lambda(*args, island=island)
+        print(str(island))
+        island.close()
+        results.put([[part.get_genome() for part in result[0]], result[1], result[2], result[3], island.index])
 #Popsize
 popsize = 10
 #Initial randomization
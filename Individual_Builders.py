@@ -1,17 +1,107 @@
 from QuantumSystem import *
 from ZX_CGP import *
+from ZX_Simplifier import *
+from LRUCache import *
+import numpy as np
 
 #Super class declaring 2 key methods
 class Individual_Builder:
+    #How each ZX_CGP part is turned into a QSystem: "layered" uses ZX_CGP.generate_qsystem and "tensor" contracts the part's diagram
+    #as a tensor network (ZX_CGP.generate_qsystem_tn), which is cheaper for wide but shallow graphs. "simplified" also contracts the
+    #diagram, after simplifying it with the builder's ZX_Simplifier (see get_simplifier). "clifford" evaluates parts whose phases are all
+    #multiples of pi / 2 as stabilizer sums (see StabilizerSum.py), contracting the rest
+    evaluator = "layered"
+    simplifier = None
+    #Layers whose products were reused from earlier individuals, and layers compiled, over every part built by the "layered" evaluator
+    #(see QSystem.compile_run_cached)
+    reused_layers = 0
+    compiled_layers = 0
+    #Compiled operators of parts keyed by layout (see part_operator), made on first use
+    part_cache_size = 1000
+    part_cache = None
+    #Whether every cached part operator is checked against one rebuilt with empty caches (see verify_part_operator)
+    verify_parts = False
+
     def initialize_individual(self):
         return [None]
 
     def build_qsystem(self, individual):
         return QSystem()
 
+    #Builds the QSystem of a single ZX_CGP part with the builder's evaluator. states is passed to generate_qsystem, see QSystem.compile,
+    #or to generate_qsystem_tn, where it keeps the diagram to be contracted with the states rather than building its full operator
+    def part_qsystem(self, part, states=None):
+        if self.evaluator == "tensor":
+            return part.generate_qsystem_tn(None, False, states)
+        if self.evaluator == "simplified":
+            return part.generate_qsystem_tn(self.get_simplifier(), False, states)
+        if self.evaluator == "clifford":
+            return part.generate_qsystem_tn(None, True, states)
+        qs = part.generate_qsystem(states)
+        self.reused_layers += qs.get_reused_layers()
+        self.compiled_layers += len(qs.layers)
+        return qs
+
+    #Gets the compiled operator of a part. Operators are cached by the part's layout (see ZX_CGP.get_layout), which only changes when a
+    #mutation changes the active graph, so the unchanged parts of an offspring are not rebuilt. The layout rather than the phenotype
+    #is used so that a cached operator is exactly the one the part would build, whatever was built before it
+    def part_operator(self, part):
+        cache = self.get_part_cache()
+        key = (self.evaluator, part.get_layout())
+        operator = cache.get(key)
+        if operator is None:
+            operator = self.part_qsystem(part).compiled_system.get_layer(0).freeze()
+            cache.put(key, operator)
+        elif self.verify_parts:
+            self.verify_part_operator(part, operator)
+        return operator
+
+    #Checks an operator against the part's operator rebuilt with empty node operator and product caches (see ZXNode.operator and
+    #QSystem.compile_run_cached), printing a warning if they differ in any bit. Returns whether they matched
+    def verify_part_operator(self, part, operator):
+        caches = [ZXNode.operator_cache, QSystem.product_cache]
+        counters = self.get_layer_reuse()
+        ZXNode.operator_cache = LRU_Cache(caches[0].max_size)
+        QSystem.product_cache = LRU_Cache(caches[1].max_size)
+        try:
+            rebuilt = self.part_qsystem(part).compiled_system.get_layer(0)
+        finally:
+            ZXNode.operator_cache, QSystem.product_cache = caches
+            self.reused_layers, self.compiled_layers = counters
+        if not np.array_equal(operator.to_array(), rebuilt.to_array()):
+            print("Warning! Cached part operator differs from the operator rebuilt with empty caches!")
+            return False
+        return True
+
+    #The part cache is left out when a builder is pickled (see Experiment.save_checkpoint), as its operators are rebuilt exactly from their
+    #layouts
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("part_cache", None)
+        return state
+
+    def get_part_cache(self):
+        if self.part_cache is None:
+            self.part_cache = LRU_Cache(self.part_cache_size)
+        return self.part_cache
+
+    #Gets [reused layers, compiled layers] over every part built
+    def get_layer_reuse(self):
+        return [self.reused_layers, self.compiled_layers]
+
+    #Gets the ZX_Simplifier used by the "simplified" evaluator, whose statistics cover every part built so far
+    def get_simplifier(self):
+        if self.simplifier is None:
+            self.simplifier = ZX_Simplifier()
+        return self.simplifier
+
 #Simple circuit builder takes dimensions for a single zxcgp instance
+#states optionally gives the number of check states each system is applied to, see QSystem.compile. With the "tensor", "simplified" or
+#"clifford" evaluator it has systems apply the contracted diagram to the check states rather than build its full operator (see
+#ZX_CGP.generate_qsystem_tn), so wider circuits can be evolved
+#evaluator is "layered", "tensor", "simplified" or "clifford", see Individual_Builder
 class Simple_Circuit_Builder(Individual_Builder):
-    def __init__(self, inp, outp, width, height, in_arity, out_arity, max_complexity):
+    def __init__(self, inp, outp, width, height, in_arity, out_arity, max_complexity, states=None, evaluator="layered"):
         self.inp = inp
         self.outp = outp
         self.width = width
@@ -19,6 +109,8 @@ class Simple_Circuit_Builder(Individual_Builder):
         self.in_arity = in_arity
         self.out_arity = out_arity
         self.max_complexity = max_complexity
+        self.states = states
+        self.evaluator = evaluator
 
     #Builds a single zxcgp instance and places it in an array
     def initialize_individual(self):
@@ -26,12 +118,12 @@ class Simple_Circuit_Builder(Individual_Builder):
 
     #Takes the first (only) zxcgp instance from an individual generated by this builder and returns its qsystem representation
     def build_qsystem(self, individual):
-        return individual[0].generate_qsystem()
+        return self.part_qsystem(individual[0], self.states)
 
 #Problem specific teleportation builder
 class TP_Builder(Individual_Builder):
-    #Entanglement circuit, alice circuit and bob circuit parameters passed
-    def __init__(self, e_width, e_height, a_width, a_height, b_width, b_height, in_arity, out_arity, bonus_complexity):
+    #Entanglement circuit, alice circuit and bob circuit parameters passed. evaluator is "layered", "tensor", "simplified" or "clifford", see Individual_Builder
+    def __init__(self, e_width, e_height, a_width, a_height, b_width, b_height, in_arity, out_arity, bonus_complexity, evaluator="layered"):
         self.e_width = e_width
         self.e_height = e_height
         self.a_width = a_width
@@ -41,6 +133,7 @@ class TP_Builder(Individual_Builder):
         self.in_arity = in_arity
         self.out_arity = out_arity
         self.c = bonus_complexity
+        self.evaluator = evaluator
 
     def initialize_individual(self):
         ent = ZX_CGP(2, self.e_width, self.e_height, 2, self.in_arity, self.out_arity, 2 + self.c)
@@ -49,10 +142,11 @@ class TP_Builder(Individual_Builder):
         return [ent, a, b]
 
     def build_qsystem(self, individual):
-        ent_m = individual[0].generate_qsystem().compiled_system.get_layer(0)
-        a_m = individual[1].generate_qsystem().compiled_system.get_layer(0)
-        b_m = individual[2].generate_qsystem().compiled_system.get_layer(0)
-        w = CMatrix([[1.0 + 0j, 0j],[0j, 1.0 + 0j]])
+        ent_m = self.part_operator(individual[0])
+        a_m = self.part_operator(individual[1])
+        b_m = self.part_operator(individual[2])
+        #Single qubit wire
+        w = IdentityMatrix(1)
         q = QSystem()
         q.new_layer()
         q.add_operator(w)
@@ -69,8 +163,9 @@ class TP_Builder(Individual_Builder):
         q.compile()
         return q
 
+#evaluator is "layered", "tensor", "simplified" or "clifford", see Individual_Builder
 class Layered_Builder(Individual_Builder):
-    def __init__(self, layers, inp, outp, width, height, in_arity, out_arity, max_complexity):
+    def __init__(self, layers, inp, outp, width, height, in_arity, out_arity, max_complexity, evaluator="layered"):
         self.layers = layers
         self.inp = inp
         self.outp = outp
@@ -79,6 +174,7 @@ class Layered_Builder(Individual_Builder):
         self.in_arity = in_arity
         self.out_arity = out_arity
         self.max_complexity = max_complexity
+        self.evaluator = evaluator
 
     #Builds a single zxcgp instance and places it in an array
     def initialize_individual(self):
@@ -86,10 +182,9 @@ class Layered_Builder(Individual_Builder):
 
     #Takes the first (only) zxcgp instance from an individual generated by this builder and returns its qsystem representation
     def build_qsystem(self, individual):
-        mN = individual[0].generate_qsystem().compiled_system.get_layer(0)
+        mN = self.part_operator(individual[0])
         for x in range(self.layers - 1):
-            q = individual[x + 1].generate_qsystem()
-            m = q.compiled_system.get_layer(0)
+            m = self.part_operator(individual[x + 1])
             mN = m * mN
         new_q = QSystem()
         new_q.new_layer()
@@ -0,0 +1,70 @@
+from ZX_CGP import *
+import queue
+#One island of an island model run (see Experiment.run_islands): a 1 + lambda population evolving in its own process, which every
+#interval generations sends its winner to the islands it is linked to and takes in the winners sent to it
+#Individuals travel as the genomes of their parts (see ZX_Genome.py) and are rebuilt around them (see ZX_CGP.from_genome)
+#Islands share a stop flag, set by the first island to reach the target score so that the others finish
+class Island:
+    #Topologies: "ring" sends to the next island only, "complete" to every other island
+    Topologies = ["ring", "complete"]
+
+    #inboxes holds a queue per island, targets lists the islands this one sends to
+    def __init__(self, index, inboxes, targets, interval, stop):
+        self.index = index
+        self.inboxes = inboxes
+        self.targets = targets
+        self.interval = interval
+        self.stop = stop
+        #Individuals sent and received
+        self.sent = 0
+        self.received = 0
+
+    #Islands each island sends to under a topology, or the topology itself if it is already a list of target lists
+    @staticmethod
+    def topology_targets(topology, count):
+        if topology == "ring":
+            return [[(index + 1) % count] for index in range(count)] if count > 1 else [[]]
+        if topology == "complete":
+            return [[t for t in range(count) if t != index] for index in range(count)]
+        if isinstance(topology, list):
+            return topology
+        print("Warning! Unknown topology " + str(topology) + ", islands will not migrate")
+        return [[] for index in range(count)]
+
+    #Called once a generation with the winner: on migration generations sends the winner and returns the individuals received, if any
+    def migrate(self, gen, winner):
+        if self.interval <= 0 or gen % self.interval != 0:
+            return []
+        genomes = [part.get_genome() for part in winner]
+        for target in self.targets:
+            self.inboxes[target].put(genomes)
+            self.sent += 1
+        immigrants = []
+        while True:
+            try:
+                genomes = self.inboxes[self.index].get_nowait()
+            except queue.Empty:
+                break
+            immigrant = [ZX_CGP.from_genome(genome) for genome in genomes]
+            #Immigrants have not been scored against this island's checks
+            for part in immigrant:
+                part.changed = True
+            immigrants.append(immigrant)
+            self.received += 1
+        return immigrants
+
+    #Whether an island has reached the target score
+    def stopped(self):
+        return self.stop.is_set()
+
+    #Tells the other islands to stop
+    def finish(self):
+        self.stop.set()
+
+    #Lets the island's process exit without waiting for individuals it sent to be taken in
+    def close(self):
+        for inbox in self.inboxes:
+            inbox.cancel_join_thread()
+
+    def __str__(self):
+        return "Island " + str(self.index) + ": sent " + str(self.sent) + ", received " + str(self.received)
@@ -0,0 +1,45 @@
+from collections import OrderedDict
+#Bounded cache which discards the least recently used entry once full. Hits and misses are counted so the cache can be sized
+class LRU_Cache:
+    #max_size is the number of entries kept
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    #Returns the value stored for key, or None if it is not cached
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    #Stores a value, evicting the least recently used entry if the cache is full
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    #Empties the cache. Counters are kept unless reset_counters is set
+    def clear(self, reset_counters=False):
+        self.entries.clear()
+        if reset_counters:
+            self.hits = 0
+            self.misses = 0
+
+    def get_hits(self):
+        return self.hits
+
+    def get_misses(self):
+        return self.misses
+
+    def get_size(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return "LRU cache: " + str(len(self.entries)) + "/" + str(self.max_size) + " entries, " + str(self.hits) + " hits, " + str(self.misses) + " misses"
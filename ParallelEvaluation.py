@@ -0,0 +1,72 @@
+from Individual_Builders import *
+from Check_Builders import *
+import multiprocessing
+#Builds and scores individuals, either in this process or on a persistent pool of worker processes
+#Workers are forked, so each starts with a copy of the individual builder and of the check builder holding the current checks, and
+#keeps its own part operator and product caches warm between generations. Only the genome of each part (see ZX_Genome.py) is sent to
+#a worker, which rebuilds the part around it (see ZX_CGP.from_genome), and only the score is sent back. When the checks are
+#reinitialised the pool is restarted so that the workers fork the new checks
+#The fork start method is needed, so the pool is only available where the platform provides it (not Windows)
+#This module must not import Experiments.py, which runs experiments when imported
+class Parallel_Evaluator:
+    #Builder and check builder of a worker process, set as the worker starts (see start_worker)
+    worker = None
+
+    #processes is the number of worker processes, 1 or fewer evaluating in this process
+    def __init__(self, individual_builder, check_builder, processes):
+        self.individual_builder = individual_builder
+        self.check_builder = check_builder
+        self.processes = processes
+        self.pool = None
+        #Check version the pool's workers hold
+        self.version = None
+
+    #Scores an individual: 1 / (1 + inactive inputs + mean error over the checks)
+    @staticmethod
+    def score(individual_builder, check_builder, ind):
+        #Use builder to generate quantum system equivalent (QSystem from QuantumSystem.py)
+        q = individual_builder.build_qsystem(ind)
+
+        #calculate error
+        error = check_builder.get_error(q)
+
+        inactive = 0.0
+        #Count inactive inputs
+        for part in range(len(ind)):
+            inactive += float(ind[part].count_inactive_inputs())
+
+        #Update score with mean of error, and penalize for inactive inputs
+        return 1.0 / (1.0 + inactive + error)
+
+    #Scores a list of individuals, returning their scores in order
+    def evaluate(self, individuals):
+        if self.processes <= 1 or len(individuals) <= 1:
+            return [Parallel_Evaluator.score(self.individual_builder, self.check_builder, ind) for ind in individuals]
+        if self.pool is None or self.version != self.check_builder.get_version():
+            self.start()
+        return self.pool.map(Parallel_Evaluator.score_genomes, [[part.get_genome() for part in ind] for ind in individuals])
+
+    #(Re)starts the pool, forking workers which hold the current checks
+    def start(self):
+        self.close()
+        context = multiprocessing.get_context("fork")
+        self.pool = context.Pool(self.processes, Parallel_Evaluator.start_worker, (self.individual_builder, self.check_builder))
+        self.version = self.check_builder.get_version()
+
+    #Stops the pool's workers
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    #Runs in each worker as it starts. With the fork start method the builders are inherited rather than pickled
+    @staticmethod
+    def start_worker(individual_builder, check_builder):
+        Parallel_Evaluator.worker = [individual_builder, check_builder]
+
+    #Runs in a worker: scores the individual made of parts with the given genomes
+    @staticmethod
+    def score_genomes(genomes):
+        individual_builder, check_builder = Parallel_Evaluator.worker
+        return Parallel_Evaluator.score(individual_builder, check_builder, [ZX_CGP.from_genome(genome) for genome in genomes])
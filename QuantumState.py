@@ -1,4 +1,5 @@
 from CMatrix import *
+import numpy as np
 import math
 import random
 
@@ -17,98 +18,62 @@ class QState:
         return self.state_data.get_raw_data()
 
     def copy(self):
-        return QState(self.state_data.get_raw_data()[0])
+        return QState.from_array(self.state_data.to_array()[:, 0].copy())
+
+    #Builds a state directly from a 1D ndarray of amplitudes
+    @staticmethod
+    def from_array(amplitudes):
+        state = QState.__new__(QState)
+        state.state_data = CMatrix.from_array(amplitudes.reshape(-1, 1))
+        return state
+
+    #View of the amplitudes as a (2^qubit, 2, 2^(n - qubit - 1)) ndarray, so that the middle axis is the value of the qubit
+    #(qubit 0 being the most significant)
+    def qubit_view(self, qubit):
+        amplitudes = self.state_data.to_array()[:, 0]
+        qubits = amplitudes.shape[0].bit_length() - 1
+        return amplitudes.reshape(1 << qubit, 2, 1 << (qubits - qubit - 1))
+
+    #Square sums of the amplitudes with the qubit of a qubit_view at 0 and at 1
+    @staticmethod
+    def outcome_weights(view):
+        return (view.real ** 2 + view.imag ** 2).sum(axis=(0, 2))
+
+    #Projects a qubit_view onto the qubit having value (0 or 1), renormalising. Returns [QState, probability of the value], the state
+    #being all zeros with probability 0 if the value cannot be measured
+    @staticmethod
+    def project(view, value, weights):
+        projected = np.zeros_like(view)
+        if weights[value] == 0:
+            return [QState.from_array(projected.reshape(-1)), 0.0]
+        projected[:, value, :] = view[:, value, :] / math.sqrt(weights[value])
+        return [QState.from_array(projected.reshape(-1)), float(weights[value] / (weights[0] + weights[1]))]
 
     #Performs a basis measurement on a specified qubit
     def measure_qubit(self, qubit):
-        state_data = self.get_raw_data()
-        self_qubits = int(math.log(len(state_data[0]), 2))
-        qubit_flip = int(math.pow(2, self_qubits - (qubit + 1)))
-        qubit_iterations = int(math.pow(2, qubit + 1))
-        state_zero = True
-        zero_total = 0.0
-        one_total = 0.0
-        for i in range(qubit_iterations):
-            for j in range(qubit_flip):
-                val = state_data[0][(i * qubit_flip) + j]
-                new_val = (val.real * val.real) + (val.imag * val.imag)
-                if state_zero:
-                    zero_total += new_val
-                else:
-                    one_total += new_val
-            state_zero = not state_zero
-        prob_total = zero_total + one_total
-        prob = random.random() * prob_total
-        mod = 0
-        if prob < zero_total:
+        view = self.qubit_view(qubit)
+        weights = QState.outcome_weights(view)
+        prob = random.random() * (weights[0] + weights[1])
+        if prob < weights[0]:
             #Qubit is measured as being in state 0
-            state_zero = True
-            mod = math.sqrt(zero_total)
-        else:
-            #Qubit is measured as being in state 1
-            state_zero = False
-            mod = math.sqrt(one_total)
-
-        new_data = [0 + 0j for x in range(len(state_data[0]))]
-        
-        if mod == 0:
-            return QState(new_data)
-
-        for i in range(qubit_iterations):
-            for j in range(qubit_flip):
-                if state_zero:
-                    new_data[(i * qubit_flip) + j] = state_data[0][(i * qubit_flip) + j] / mod
-            state_zero = not state_zero
-        return QState(new_data)
+            return QState.project(view, 0, weights)[0]
+        #Qubit is measured as being in state 1
+        return QState.project(view, 1, weights)[0]
 
     #Instead of raw measurement, we measure for a specific value, returning the probability of that measurement
     def measure_qubit_to_value(self, qubit, zero_value):
-        state_data = self.get_raw_data()
-        self_qubits = int(math.log(len(state_data[0]), 2))
-        qubit_flip = int(math.pow(2, self_qubits - (qubit + 1)))
-        qubit_iterations = int(math.pow(2, qubit + 1))
-        state_zero = True
-        zero_total = 0.0
-        one_total = 0.0
-        for i in range(qubit_iterations):
-            for j in range(qubit_flip):
-                val = state_data[0][(i * qubit_flip) + j]
-                new_val = (val.real * val.real) + (val.imag * val.imag)
-                if state_zero:
-                    zero_total += new_val
-                else:
-                    one_total += new_val
-            state_zero = not state_zero
-        prob_total = zero_total + one_total
-        prob = random.random() * prob_total
-        mod = 0
-        if zero_value:
-            #Qubit is measured as being in state 0
-            state_zero = True
-            mod = math.sqrt(zero_total)
-        else:
-            #Qubit is measured as being in state 1
-            state_zero = False
-            mod = math.sqrt(one_total)
-
-        new_data = [0 + 0j for x in range(len(state_data[0]))]
-        
-        if mod == 0:
-            return [QState(new_data), 0.0]
-
-        for i in range(qubit_iterations):
-            for j in range(qubit_flip):
-                if state_zero:
-                    new_data[(i * qubit_flip) + j] = state_data[0][(i * qubit_flip) + j] / mod
-            state_zero = not state_zero
-        if zero_value:
-            return [QState(new_data), zero_total / prob_total]
-        else:
-            return [QState(new_data), one_total / prob_total]
-        
+        view = self.qubit_view(qubit)
+        return QState.project(view, 0 if zero_value else 1, QState.outcome_weights(view))
+
+    #Measures a qubit for both values at once. Returns [[QState, probability] for the qubit at 0, [QState, probability] for it at 1], as
+    #measure_qubit_to_value would for each
+    def measure_qubit_branches(self, qubit):
+        view = self.qubit_view(qubit)
+        weights = QState.outcome_weights(view)
+        return [QState.project(view, 0, weights), QState.project(view, 1, weights)]
 
     def apply_operator(self, op_matrix):
-        return QState((op_matrix * self.state_data).get_raw_data()[0])
+        return QState.from_array(op_matrix.apply_array(self.state_data.to_array())[:, 0])
 
     def normalize(self):
         self.state_data = self.state_data.normalize()
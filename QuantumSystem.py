@@ -1,9 +1,16 @@
 from CMatrix import CMatrix
+from StructuredMatrix import *
 from QuantumState import QState
+from LRUCache import *
 import math
 import cmath
 #Class for building and using a Quantum System made of CMatrix operators and basis measurement layers
 class QSystem:
+    #Products of blocks of keyed layers, shared by every system (see compile_run_cached), keyed by the keys of the block's layers
+    #Products are frozen as they are handed out without copying
+    product_cache = LRU_Cache(2048)
+    #Number of layers in each block of a keyed run
+    block_size = 4
 
     #Param not required. Flags set to false used to indicate whether the system is currently building or compiled
     def __init__(self):
@@ -14,6 +21,10 @@ class QSystem:
         self.measure_flags = []
         self.current_layer = []
         self.compiled_system = None
+        #Key of each layer, see close_layer
+        self.layer_keys = []
+        #Number of layers whose products were reused by the last compile, see compile_run_cached
+        self.reused_layers = 0
 
     #Can be used to set a flag indicating that this is the compiled form of another system. This means that it should not be compiled and should be executed as is.
     def compiled_flag(self):
@@ -28,6 +39,8 @@ class QSystem:
         self.measure_flags = []
         self.current_layer = []
         self.compiled_system = None
+        self.layer_keys = []
+        self.reused_layers = 0
 
     #Adds a new layer. If an old layer still existed then it is tensored together and stored in the layers array
     def new_layer(self):
@@ -37,21 +50,29 @@ class QSystem:
         self.layer_unfinished = True
 
     #Closes the current layer. Matrices are tensored together and added to the layers array as a new layer
-    def close_layer(self):
-        m = CMatrix([[1 + 0j]])
-        for i in range(len(self.current_layer)):
-           m = m / self.current_layer[i]
+    #The tensor product is kept factored (see KroneckerMatrix in StructuredMatrix.py) so that each operator is applied to its own
+    #qubits of a state, and identity wires are skipped, rather than building the full identity-padded matrix
+    #key optionally identifies the layer's content: layers with equal keys must have equal operators. When every layer of a run is
+    #keyed, compile reuses cached products of the run's first and last layers
+    def close_layer(self, key=None):
+        if len(self.current_layer) == 1:
+            m = self.current_layer[0]
+        else:
+            m = KroneckerMatrix(self.current_layer)
         self.layers.append(m)
         self.measure_flags.append(False)
+        self.layer_keys.append(key)
         self.layer_unfinished = False
         self.current_layer = []
 
     #Closes the current layer, inserting a connection matrix in-front of it to connect qubits from the previous layer to the correct components of this layer
-    def close_layer_with_connection_matrix(self, connection_matrix):
+    #key and connection_key optionally identify the layer and the connection matrix, see close_layer
+    def close_layer_with_connection_matrix(self, connection_matrix, key=None, connection_key=None):
         #Insert the connection matrix, indicating that it is not a measurement layer
         self.layers.append(connection_matrix)
         self.measure_flags.append(False)
-        self.close_layer()
+        self.layer_keys.append(connection_key)
+        self.close_layer(key)
 
     #Gets the most recent compilation
     def get_compiled_version(self):
@@ -68,30 +89,86 @@ class QSystem:
     def add_measurement_layer(self, measure_qubits):
         self.layers.append(measure_qubits)
         self.measure_flags.append(True)
+        self.layer_keys.append(None)
 
     # Compiles the system into a simpler form by collapsing multiplications
-    def compile(self):
+    #Each run of consecutive operator layers is multiplied in the order with the lowest estimated cost rather than strictly left to right
+    #(see ProductMatrix in StructuredMatrix.py). If states, the number of states the system is going to be applied to, is given then a
+    #run is left as an unmultiplied ProductMatrix whenever applying it layer by layer is cheaper than forming and applying the full operator
+    #Otherwise runs whose layers are all keyed are multiplied reusing cached products (see compile_run_cached)
+    def compile(self, states=None):
         self.compiled = True
         self.compiled_system = QSystem()
         self.compiled_system.new_layer()
         self.compiled_system.compiled_flag()
-        m = None
+        self.reused_layers = 0
+        run = []
+        keys = []
         for i in range(len(self.layers)):
             if self.measure_flags[i]:
-                if m is not None:
-                    self.compiled_system.add_operator(m)
+                if len(run) > 0:
+                    self.compiled_system.add_operator(self.compile_layers(run, keys, states))
                     self.compiled_system.new_layer()
-                    m = None
+                    run = []
+                    keys = []
                 self.compiled_system.add_measurement_layer(self.layers[i])
             else:
-                if m is None:
-                    m = self.layers[i]
-                else:
-                    m = self.layers[i] * m
-        if m is not None:
-            self.compiled_system.add_operator(m)
+                run.append(self.layers[i])
+                keys.append(self.layer_keys[i])
+        if len(run) > 0:
+            self.compiled_system.add_operator(self.compile_layers(run, keys, states))
             self.compiled_system.close_layer()
 
+    #Collapses a run of operator layers with their keys, reusing cached products when every layer is keyed and the full operator is wanted
+    def compile_layers(self, run, keys, states):
+        if states is None and None not in keys:
+            return self.compile_run_cached(run, keys)
+        return QSystem.compile_run(run, states)
+
+    #Collapses a run of operator layers, listed in the order they are applied, into a single operator
+    @staticmethod
+    def compile_run(run, states):
+        if len(run) == 1:
+            return run[0]
+        order = ProductMatrix.chain_order(run)
+        if states is not None:
+            factored = ProductMatrix(run)
+            shape = factored.get_shape()
+            if factored.apply_cost(states) < order[0] + float(shape[0]) * shape[1] * states:
+                return factored
+        return ProductMatrix.multiply_range(run, order[1], 0, len(run) - 1)
+
+    #Multiplies a run of keyed layers, listed in the order they are applied. The run is cut into blocks of block_size layers at fixed
+    #positions, and the product of each block is cached under the keys of its layers, so an individual which differs from its parent in a
+    #few columns only multiplies the blocks holding them. Blocks, and then the run of block products, are multiplied in chain order (see
+    #ProductMatrix.chain_order). The bracketing depends only on the run, never on what happens to be cached, so the product is identical
+    #whether its blocks were cached or not
+    #Counts the layers of cached blocks in reused_layers
+    def compile_run_cached(self, run, keys):
+        if len(run) == 1:
+            return run[0]
+        cache = QSystem.product_cache
+        size = QSystem.block_size
+        products = []
+        for start in range(0, len(run), size):
+            block = run[start:start + size]
+            if len(block) == 1:
+                products.append(block[0])
+                continue
+            key = tuple(keys[start:start + size])
+            product = cache.get(key)
+            if product is None:
+                product = ProductMatrix.multiply_chain(block)
+                cache.put(key, product.freeze())
+            else:
+                self.reused_layers += len(block)
+            products.append(product)
+        return ProductMatrix.multiply_chain(products)
+
+    #Gets the number of layers whose products were reused by the last compile
+    def get_reused_layers(self):
+        return self.reused_layers
+
     #Applies the system to some input quantum state
     def apply(self, input_state):
         if(self.compiled):
@@ -112,6 +189,19 @@ class QSystem:
                     current_state = current_state.apply_operator(current_layer)
             return current_state
 
+    #Applies the system to a (2^n, k) ndarray of k column states at once, returning the (2^n, k) results, or None if the system has
+    #measurement layers, as those are drawn state by state (see apply)
+    def apply_states(self, states):
+        if(self.compiled):
+            return self.compiled_system.apply_states(states)
+        if not self.is_compiled_system:
+            print("Warning: The system executed has not been compiled!")
+        if True in self.measure_flags:
+            return None
+        for layer in self.layers:
+            states = layer.apply_array(states)
+        return states
+
     @staticmethod
     def generate_qft(qbits):
         states = int(math.pow(2, qbits))
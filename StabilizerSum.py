@@ -0,0 +1,261 @@
+from ZXNode import *
+import numpy as np
+import math
+#Evaluates Clifford ZX diagrams (see ZX_Diagram.py) in polynomial time, rather than contracting dense tensors
+#A Clifford diagram's operator is a stabilizer sum: scalar * sum over boolean variables x of i^P(x), where P is a polynomial mod 4 with
+#linear terms a * x_j and quadratic terms 2 * x_j * x_k, restricted by affine constraints (XORs of variables equal to a constant)
+#Every edge leg of a vertex is an affine expression of variables: a green spider gives all of its legs one variable, a red spider gives
+#each leg its own variable joined to the spider's by 2 * z * y terms (the Hadamards), and so on (see add_vertex). Joined legs must be
+#equal, which is an affine constraint. Constraints are solved by substituting a variable away, and every variable not on the boundary
+#is then summed out exactly:
+#sum_z i^(a * z + 2 * z * L) is 2 * delta(L = a / 2) for even a, a new constraint, and (1 + i^a) * i^(e * L) for odd a (e = 3 for a = 1,
+#e = 1 for a = 3), L being lifted from a XOR into a polynomial mod 4
+#What remains is a polynomial over the boundary variables, which is read off for every input and output basis state, so building the
+#operator still takes 2^(inputs + outputs) time and memory like the other evaluators
+#The scalar is kept exactly, global phase included, so the operator matches ZX_Diagram.evaluate rather than only up to a scalar
+#Expressions are [mask, constant] pairs, the mask having bit j set for variable j
+class Stabilizer_Sum:
+    #i^k for k mod 4
+    Powers = [1.0 + 0j, 1j, -1.0 + 0j, -1j]
+
+    def __init__(self):
+        self.variables = 0
+        #Mask of the variables still to be summed out
+        self.internal = 0
+        #P: linear coefficients mod 4 by variable, and the variables each variable has a 2 * x_j * x_k term with
+        self.linear = {}
+        self.quadratic = {}
+        self.scalar = 1.0 + 0j
+        self.zero = False
+        #Constraints still to be solved, and solved constraints on boundary variables only
+        self.constraints = []
+        self.boundary_constraints = []
+        #Boundary variables of the diagram's open legs, in qubit order
+        self.inputs = []
+        self.outputs = []
+
+    #Adds a variable, returning its index. Boundary variables are never summed out
+    def new_variable(self, boundary=False):
+        self.variables += 1
+        if not boundary:
+            self.internal |= 1 << (self.variables - 1)
+        return self.variables - 1
+
+    #Multiplies the sum by i^(k * x)
+    def add_phase(self, x, k):
+        k = (self.linear.get(x, 0) + k) % 4
+        if k == 0:
+            self.linear.pop(x, None)
+        else:
+            self.linear[x] = k
+
+    #Multiplies the sum by (-1)^(x * y)
+    def add_edge(self, x, y):
+        if x == y:
+            self.add_phase(x, 2)
+            return
+        for u, v in [[x, y], [y, x]]:
+            neighbours = self.quadratic.setdefault(u, set())
+            if v in neighbours:
+                neighbours.remove(v)
+            else:
+                neighbours.add(v)
+
+    #Multiplies the sum by i^(e * (constant XOR the variables of mask)), lifting the XOR into a polynomial mod 4:
+    #y_1 XOR ... XOR y_n = sum y_j - 2 * sum_(j<k) y_j * y_k and 1 XOR Y = 1 - Y
+    def add_lifted(self, mask, constant, e):
+        if constant:
+            self.scalar *= Stabilizer_Sum.Powers[e % 4]
+            e = -e
+        e %= 4
+        if e == 0:
+            return
+        variables = Stabilizer_Sum.bits(mask)
+        for j in range(len(variables)):
+            self.add_phase(variables[j], e)
+            #The pair terms have coefficient -2 * e, which is 2 mod 4 for odd e
+            if e % 2 == 1:
+                for k in range(j + 1, len(variables)):
+                    self.add_edge(variables[j], variables[k])
+
+    #Variables in a mask
+    @staticmethod
+    def bits(mask):
+        variables = []
+        while mask:
+            low = mask & -mask
+            variables.append(low.bit_length() - 1)
+            mask ^= low
+        return variables
+
+    #Replaces variable x by constant XOR the variables of mask everywhere
+    def substitute(self, x, mask, constant):
+        self.internal &= ~(1 << x)
+        self.add_lifted(mask, constant, self.linear.pop(x, 0))
+        for w in self.quadratic.pop(x, set()):
+            self.quadratic[w].discard(x)
+            #2 * (constant XOR Y) * w = 2 * constant * w + sum over y in Y of 2 * y * w, mod 4
+            if constant:
+                self.add_phase(w, 2)
+            for y in Stabilizer_Sum.bits(mask):
+                self.add_edge(y, w)
+        bit = 1 << x
+        for c in self.constraints:
+            if c[0] & bit:
+                c[0] ^= bit ^ mask
+                c[1] ^= constant
+
+    #Requires the variables of mask to XOR to constant
+    def add_constraint(self, mask, constant):
+        self.constraints.append([mask, constant])
+
+    #Solves the pending constraints, substituting away an internal variable of each where there is one
+    def solve_constraints(self):
+        while len(self.constraints) > 0 and not self.zero:
+            mask, constant = self.constraints.pop()
+            internal = mask & self.internal
+            if internal:
+                x = (internal & -internal).bit_length() - 1
+                self.substitute(x, mask ^ (1 << x), constant)
+            elif mask:
+                self.boundary_constraints.append([mask, constant])
+            elif constant:
+                #0 = 1: the operator is zero
+                self.zero = True
+
+    #Sums out every internal variable
+    def reduce(self):
+        self.solve_constraints()
+        while self.internal and not self.zero:
+            z = (self.internal & -self.internal).bit_length() - 1
+            self.internal &= ~(1 << z)
+            a = self.linear.pop(z, 0)
+            mask = 0
+            for w in self.quadratic.pop(z, set()):
+                self.quadratic[w].discard(z)
+                mask |= 1 << w
+            if a % 2 == 1:
+                self.scalar *= 1 + Stabilizer_Sum.Powers[a]
+                self.add_lifted(mask, 0, 3 if a == 1 else 1)
+            else:
+                self.scalar *= 2
+                self.add_constraint(mask, a // 2)
+                self.solve_constraints()
+
+    #Gets a phase as a number of quarter turns, or None if it is not a multiple of pi / 2
+    @staticmethod
+    def quarter_turns(phase):
+        q = ZXNode.quantise_phase(phase) / (math.pi / 2.0)
+        k = int(round(q))
+        if abs(q - k) > 1e-9:
+            return None
+        return k % 4
+
+    #Expression for a spider's variable: a new variable with phase k when it has inputs and outputs, else the constant a generator or
+    #destructor fixes, as its weights cos and sin of k * pi / 2 leave a single basis state with sign
+    def spider_variable(self, k, general):
+        if general:
+            z = self.new_variable()
+            self.add_phase(z, k)
+            return [1 << z, 0]
+        if k >= 2:
+            self.scalar *= -1
+        return [0, k % 2]
+
+    #Adds a vertex's variables and terms, returning the expressions of its legs (outputs then inputs, as in ZX_Vertex.get_tensor), or
+    #None if the vertex is not Clifford
+    def add_vertex(self, v):
+        ins = len(v.inputs)
+        outs = len(v.outputs)
+        if v.function is ZXNode.Function_Set.H:
+            k = 0
+        else:
+            k = Stabilizer_Sum.quarter_turns(v.phase)
+            if k is None:
+                return None
+        #Controlled nodes (see ZXNode.build_operator) are Clifford when the controlled gate is the identity, Z (controlled Z) or X (CNOT)
+        if v.controlled and ins == outs and ins != 1:
+            legs = [self.new_variable() for j in range(ins)]
+            inputs = [[1 << x, 0] for x in legs]
+            outputs = [list(e) for e in inputs]
+            if v.function is ZXNode.Function_Set.H or (k != 0 and (ins != 2 or k != 2)):
+                return None
+            if k == 2 and v.function is ZXNode.Function_Set.G:
+                self.add_edge(legs[0], legs[1])
+            elif k == 2:
+                outputs[1] = [(1 << legs[0]) | (1 << legs[1]), 0]
+            return outputs + inputs
+        if v.function is ZXNode.Function_Set.H:
+            #Green splitters either side of a Hadamard, the missing side being a 0 phase generator or destructor, e.g. |0>
+            self.scalar /= math.sqrt(2.0)
+            x = self.spider_variable(0, ins > 0)
+            y = self.spider_variable(0, outs > 0)
+            if x[0] and y[0]:
+                self.add_edge(x[0].bit_length() - 1, y[0].bit_length() - 1)
+            return [y] * outs + [x] * ins
+        z = self.spider_variable(k, ins > 0 and outs > 0)
+        if v.function is ZXNode.Function_Set.G:
+            return [z] * (outs + ins)
+        #Red: a Hadamard on every leg of the green spider
+        legs = []
+        for j in range(outs + ins):
+            y = self.new_variable()
+            self.scalar /= math.sqrt(2.0)
+            if z[0]:
+                self.add_edge(z[0].bit_length() - 1, y)
+            elif z[1]:
+                self.add_phase(y, 2)
+            legs.append([1 << y, 0])
+        return legs
+
+    #Builds and reduces the stabilizer sum of a diagram, or returns None if the diagram is not Clifford
+    @staticmethod
+    def from_zx_diagram(diagram):
+        s = Stabilizer_Sum()
+        ends = {}
+        for v in diagram.vertices:
+            legs = s.add_vertex(v)
+            if legs is None:
+                return None
+            for label, e in zip(v.outputs + v.inputs, legs):
+                ends.setdefault(label, []).append(e)
+        for labels, boundary in [[diagram.outputs, s.outputs], [diagram.inputs, s.inputs]]:
+            for label in labels:
+                x = s.new_variable(True)
+                boundary.append(x)
+                ends.setdefault(label, []).append([1 << x, 0])
+        #Joined legs are equal
+        for e in ends.values():
+            if len(e) == 2:
+                s.add_constraint(e[0][0] ^ e[1][0], e[0][1] ^ e[1][1])
+        s.reduce()
+        return s
+
+    #The (2^outputs, 2^inputs) operator as an ndarray. This is dense in the boundary legs: only the reduction of the internal variables
+    #is polynomial. Parts are composed and cached as operators (see Individual_Builder.part_operator), so the sum is not applied to the
+    #check states directly
+    def to_array(self):
+        boundary = self.outputs + self.inputs
+        count = len(boundary)
+        if self.zero:
+            return np.zeros((1 << len(self.outputs), 1 << len(self.inputs)), dtype=np.complex128)
+        #values[x] is the bit of boundary variable x in every basis state, most significant qubit first
+        index = np.arange(1 << count)
+        values = {}
+        for position in range(count):
+            values[boundary[position]] = (index >> (count - 1 - position)) & 1
+        exponent = np.zeros(1 << count, dtype=np.int64)
+        for x, a in self.linear.items():
+            exponent += a * values[x]
+        for x, neighbours in self.quadratic.items():
+            for y in neighbours:
+                #Each pair is held from both ends
+                if x < y:
+                    exponent += 2 * values[x] * values[y]
+        result = self.scalar * np.array(Stabilizer_Sum.Powers)[exponent % 4]
+        for mask, constant in self.boundary_constraints:
+            parity = np.zeros(1 << count, dtype=np.int64)
+            for x in Stabilizer_Sum.bits(mask):
+                parity ^= values[x]
+            result = np.where(parity == constant, result, 0)
+        return result.reshape(1 << len(self.outputs), 1 << len(self.inputs))
@@ -0,0 +1,483 @@
+from CMatrix import *
+import numpy as np
+import math
+#Operators that remember their structure so that they can be multiplied, tensored and applied to states without building the
+#dense 2^in x 2^out matrix. Each class keeps the CMatrix API (see CMatrix.py). Where no structured rule exists the operation
+#falls back to dense, and the dense form is only built (and then kept) when it is actually needed
+class StructuredMatrix(CMatrix):
+    def __init__(self):
+        self.dense = None
+        self.frozen = False
+
+    #Dense (row, column) ndarray, built on demand. Structured operators are never modified so it is kept once built
+    @property
+    def matrix(self):
+        if self.dense is None:
+            self.dense = self.build_array()
+            self.dense.flags.writeable = not self.frozen
+        return self.dense
+
+    #Makes every array held by the operator, and any factors, read-only. Lists of plain values, such as permutation axes, are left alone
+    def freeze(self):
+        self.frozen = True
+        for value in vars(self).values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            elif isinstance(value, list):
+                for f in value:
+                    if hasattr(f, "freeze"):
+                        f.freeze()
+        return self
+
+    #Builds the dense (row, column) ndarray of the operator
+    def build_array(self):
+        return None
+
+    #Returns the structured product self * other, or None if there is no structured rule for the pair
+    def compose(self, other):
+        return None
+
+    #Multiplication keeps structure where possible, otherwise the other operand is densified and this operator is applied to it
+    def __mul__(self, other):
+        #Wires do not change the other operand
+        if self.is_identity():
+            return other
+        if other.is_identity():
+            return self
+        product = self.compose(other)
+        if product is None:
+            product = CMatrix.from_array(self.apply_array(other.to_array()))
+        return product
+
+    #Tensoring structured operators keeps each operand as a factor
+    def tensor(self, other):
+        return KroneckerMatrix(self.get_factors() + other.get_factors())
+
+    #Returns the number of qubits spanned by a dimension, dimensions being powers of 2
+    @staticmethod
+    def qubits(dimension):
+        return dimension.bit_length() - 1
+
+#A spider-like operator whose only non-zero entries lie on the corners |0...0> and |1...1> of its input and output spaces
+#The corner values are held in a small core: 2 x 2 in general, 2 x 1 for generators (0 inputs) and 1 x 2 for destructors (0 outputs)
+class SpiderMatrix(StructuredMatrix):
+    def __init__(self, inputs, outputs, core):
+        StructuredMatrix.__init__(self)
+        self.inputs = inputs
+        self.outputs = outputs
+        self.core = np.asarray(core, dtype=np.complex128)
+        self.rows = SpiderMatrix.corners(outputs)
+        self.cols = SpiderMatrix.corners(inputs)
+
+    #Indices of |0...0> and |1...1> for a number of qubits. A single index is used when there are no qubits
+    @staticmethod
+    def corners(qubits):
+        if qubits == 0:
+            return np.array([0])
+        return np.array([0, (1 << qubits) - 1])
+
+    def get_shape(self):
+        return (1 << self.outputs, 1 << self.inputs)
+
+    def build_array(self):
+        m = np.zeros(self.get_shape(), dtype=np.complex128)
+        m[np.ix_(self.rows, self.cols)] = self.core
+        return m
+
+    def apply_array(self, v):
+        out = np.zeros((1 << self.outputs, v.shape[1]), dtype=np.complex128)
+        out[self.rows] = self.core @ v[self.cols]
+        return out
+
+    def left_apply_array(self, m):
+        out = np.zeros((m.shape[0], 1 << self.inputs), dtype=np.complex128)
+        out[:, self.cols] = m[:, self.rows] @ self.core
+        return out
+
+    #Filling the zero output dominates the small core product
+    def apply_cost(self, columns):
+        return float((1 << self.outputs) + self.core.size) * columns
+
+    #Red spiders (see RedSpiderMatrix) keep their cores in another basis, so only green spiders compose through their cores
+    def compose(self, other):
+        if type(other) is SpiderMatrix:
+            return SpiderMatrix(other.inputs, self.outputs, self.core @ other.core)
+        if isinstance(other, DiagonalMatrix):
+            return SpiderMatrix(self.inputs, self.outputs, self.core * other.diagonal[self.cols][None, :])
+        #With at most 1 input qubit every column is a corner, so a small operator on the right folds into the core
+        rows, cols = other.get_shape()
+        if self.inputs <= 1 and cols <= 2:
+            return SpiderMatrix(StructuredMatrix.qubits(cols), self.outputs, self.core @ other.to_array())
+        return None
+
+#A red spider, e.g. a SpiderMatrix with a Hadamard on every input and output. Hadamards map |0...0> and |1...1> to the states
+#|+...+> and |-...->, whose entries are 2^(-n/2) and 2^(-n/2) * (-1)^(parity of the index), so the operator is built and applied by
+#index arithmetic on those two vectors, with no Hadamard matrices or dense products
+class RedSpiderMatrix(SpiderMatrix):
+    #Cache of parity sign vectors, indexed by number of qubits
+    parities = {}
+
+    def __init__(self, inputs, outputs, core):
+        SpiderMatrix.__init__(self, inputs, outputs, core)
+        self.row_basis = RedSpiderMatrix.basis(outputs)
+        self.col_basis = RedSpiderMatrix.basis(inputs)
+
+    #Returns (-1)^(number of 1 bits) for every index over a number of qubits
+    @staticmethod
+    def parity(qubits):
+        p = RedSpiderMatrix.parities.get(qubits)
+        if p is None:
+            p = np.ones(1)
+            for q in range(qubits):
+                p = np.concatenate((p, -p))
+            p.flags.writeable = False
+            RedSpiderMatrix.parities[qubits] = p
+        return p
+
+    #Columns are |+...+> and |-...->, or the scalar 1 when there are no qubits
+    @staticmethod
+    def basis(qubits):
+        if qubits == 0:
+            return np.ones((1, 1))
+        scale = math.pow(2.0, -qubits / 2.0)
+        return np.stack((np.full(1 << qubits, scale), RedSpiderMatrix.parity(qubits) * scale), axis=1)
+
+    def build_array(self):
+        return self.row_basis @ self.core @ self.col_basis.T
+
+    def apply_array(self, v):
+        return self.row_basis @ (self.core @ (self.col_basis.T @ v))
+
+    def left_apply_array(self, m):
+        return ((m @ self.row_basis) @ self.core) @ self.col_basis.T
+
+    def apply_cost(self, columns):
+        return float(2 * ((1 << self.outputs) + (1 << self.inputs)) + self.core.size) * columns
+
+    def compose(self, other):
+        #The basis vectors are orthonormal, so red spiders compose through their cores
+        if isinstance(other, RedSpiderMatrix):
+            return RedSpiderMatrix(other.inputs, self.outputs, self.core @ other.core)
+        return None
+
+#A controlled operator: the identity, except for a 2 x 2 target acting on the last 2 basis states, e.g. when all control qubits are 1
+class ControlledMatrix(StructuredMatrix):
+    def __init__(self, control_bits, target):
+        StructuredMatrix.__init__(self)
+        self.size = 1 << (control_bits + 1)
+        self.target = np.asarray(target, dtype=np.complex128)
+
+    def get_shape(self):
+        return (self.size, self.size)
+
+    def build_array(self):
+        m = np.eye(self.size, dtype=np.complex128)
+        m[self.size - 2:, self.size - 2:] = self.target
+        return m
+
+    def apply_array(self, v):
+        out = np.array(v, dtype=np.complex128)
+        out[self.size - 2:] = self.target @ v[self.size - 2:]
+        return out
+
+    def left_apply_array(self, m):
+        out = np.array(m, dtype=np.complex128)
+        out[:, self.size - 2:] = m[:, self.size - 2:] @ self.target
+        return out
+
+    def apply_cost(self, columns):
+        return float(self.size + 4) * columns
+
+    def compose(self, other):
+        if isinstance(other, ControlledMatrix) and other.size == self.size:
+            return ControlledMatrix(StructuredMatrix.qubits(self.size) - 1, self.target @ other.target)
+        return None
+
+#Identity over a number of qubits, e.g. wires passing through a layer. Applying it is free
+class IdentityMatrix(StructuredMatrix):
+    def __init__(self, qubits):
+        StructuredMatrix.__init__(self)
+        self.size = 1 << qubits
+
+    def get_shape(self):
+        return (self.size, self.size)
+
+    def is_identity(self):
+        return True
+
+    def build_array(self):
+        return np.eye(self.size, dtype=np.complex128)
+
+    def apply_array(self, v):
+        return v
+
+    def left_apply_array(self, m):
+        return m
+
+    def apply_cost(self, columns):
+        return 0.0
+
+#Operator that maps each basis state |j> to |perm[j]>
+class PermutationMatrix(StructuredMatrix):
+    def __init__(self, perm):
+        StructuredMatrix.__init__(self)
+        self.perm = np.asarray(perm, dtype=np.intp)
+        #Source index of each destination, so that applying the permutation is a gather
+        self.source = np.empty_like(self.perm)
+        self.source[self.perm] = np.arange(len(self.perm))
+
+    def get_shape(self):
+        return (len(self.perm), len(self.perm))
+
+    def build_array(self):
+        m = np.zeros(self.get_shape(), dtype=np.complex128)
+        m[self.perm, np.arange(len(self.perm))] = 1 + 0j
+        return m
+
+    def apply_array(self, v):
+        return v[self.source]
+
+    def left_apply_array(self, m):
+        return m[:, self.perm]
+
+    def apply_cost(self, columns):
+        return float(len(self.perm)) * columns
+
+    def compose(self, other):
+        if isinstance(other, PermutationMatrix):
+            return PermutationMatrix(self.perm[other.perm])
+        if isinstance(other, QubitPermutationMatrix):
+            return PermutationMatrix(self.perm[other.get_permutation()])
+        return None
+
+#Operator that permutes qubits rather than basis states: input qubit i becomes output qubit axes[i], qubit 0 being the most significant
+#It is applied to a state by viewing the state as one axis per qubit and transposing, so neither the 2^k x 2^k matrix nor the
+#basis state permutation is built, and two qubit permutations compose into another by composing their axes
+class QubitPermutationMatrix(StructuredMatrix):
+    def __init__(self, axes):
+        StructuredMatrix.__init__(self)
+        self.axes = [int(axis) for axis in axes]
+        #Input qubit of each output qubit, e.g. the transpose order of a state's axes
+        self.source = [0 for axis in self.axes]
+        for i in range(len(self.axes)):
+            self.source[self.axes[i]] = i
+
+    def get_shape(self):
+        size = 1 << len(self.axes)
+        return (size, size)
+
+    def is_identity(self):
+        for i in range(len(self.axes)):
+            if self.axes[i] != i:
+                return False
+        return True
+
+    #Basis state permutation equivalent to the qubit permutation, e.g. the perm of a PermutationMatrix
+    def get_permutation(self):
+        qubits = len(self.axes)
+        indices = np.arange(1 << qubits).reshape([2] * qubits)
+        return np.transpose(indices, self.axes).reshape(-1)
+
+    def build_array(self):
+        return PermutationMatrix(self.get_permutation()).to_array()
+
+    def apply_array(self, v):
+        qubits = len(self.axes)
+        k = v.shape[1]
+        t = v.reshape([2] * qubits + [k])
+        return np.transpose(t, self.source + [qubits]).reshape(-1, k)
+
+    def left_apply_array(self, m):
+        qubits = len(self.axes)
+        k = m.shape[0]
+        t = m.reshape([k] + [2] * qubits)
+        return np.transpose(t, [0] + [axis + 1 for axis in self.axes]).reshape(k, -1)
+
+    def apply_cost(self, columns):
+        return float(self.get_shape()[1]) * columns
+
+    def compose(self, other):
+        if isinstance(other, QubitPermutationMatrix) and len(other.axes) == len(self.axes):
+            return QubitPermutationMatrix([self.axes[axis] for axis in other.axes])
+        if isinstance(other, PermutationMatrix):
+            return PermutationMatrix(self.get_permutation()[other.perm])
+        return None
+
+#Diagonal operator
+class DiagonalMatrix(StructuredMatrix):
+    def __init__(self, diagonal):
+        StructuredMatrix.__init__(self)
+        self.diagonal = np.asarray(diagonal, dtype=np.complex128)
+
+    def get_shape(self):
+        return (len(self.diagonal), len(self.diagonal))
+
+    def build_array(self):
+        return np.diag(self.diagonal)
+
+    def apply_array(self, v):
+        return self.diagonal[:, None] * v
+
+    def left_apply_array(self, m):
+        return m * self.diagonal[None, :]
+
+    def apply_cost(self, columns):
+        return float(len(self.diagonal)) * columns
+
+    def compose(self, other):
+        if isinstance(other, DiagonalMatrix):
+            return DiagonalMatrix(self.diagonal * other.diagonal)
+        if type(other) is SpiderMatrix:
+            return SpiderMatrix(other.inputs, other.outputs, self.diagonal[other.rows][:, None] * other.core)
+        return None
+
+#Kronecker (tensor) product of a list of factors, the first factor acting on the most significant qubits
+#The product is applied to states by contracting each factor against its own axes of the reshaped state
+class KroneckerMatrix(StructuredMatrix):
+    def __init__(self, factors):
+        StructuredMatrix.__init__(self)
+        self.factors = []
+        for f in factors:
+            self.factors += f.get_factors()
+
+    def get_factors(self):
+        return list(self.factors)
+
+    def get_shape(self):
+        rows = 1
+        cols = 1
+        for f in self.factors:
+            shape = f.get_shape()
+            rows *= shape[0]
+            cols *= shape[1]
+        return (rows, cols)
+
+    def is_identity(self):
+        for f in self.factors:
+            if not f.is_identity():
+                return False
+        return True
+
+    def build_array(self):
+        m = np.ones((1, 1), dtype=np.complex128)
+        for f in self.factors:
+            m = np.kron(m, f.to_array())
+        return m
+
+    #Each factor is contracted against its own axes of the state, reshaped to one axis per factor. Identity factors are skipped
+    def apply_array(self, v):
+        k = v.shape[1]
+        t = v.reshape([f.get_shape()[1] for f in self.factors] + [k])
+        for i in range(len(self.factors)):
+            f = self.factors[i]
+            if f.is_identity():
+                continue
+            t = np.moveaxis(t, i, 0)
+            rest = t.shape[1:]
+            t = f.apply_array(t.reshape(f.get_shape()[1], -1)).reshape((f.get_shape()[0],) + rest)
+            t = np.moveaxis(t, 0, i)
+        return t.reshape(-1, k)
+
+    def left_apply_array(self, m):
+        k = m.shape[0]
+        count = len(self.factors)
+        t = m.reshape([k] + [f.get_shape()[0] for f in self.factors])
+        for i in range(count):
+            f = self.factors[i]
+            if f.is_identity():
+                continue
+            t = np.moveaxis(t, i + 1, count)
+            rest = t.shape[:count]
+            t = f.left_apply_array(t.reshape(-1, f.get_shape()[0])).reshape(rest + (f.get_shape()[1],))
+            t = np.moveaxis(t, count, i + 1)
+        return t.reshape(k, -1)
+
+    #Each factor is applied to every slice of the state along its own axes
+    def apply_cost(self, columns):
+        cost = 0.0
+        size = float(self.get_shape()[1]) * columns
+        for f in self.factors:
+            rows, cols = f.get_shape()
+            cost += f.apply_cost(size / cols)
+            size = size / cols * rows
+        return cost
+
+    def compose(self, other):
+        #Factor-by-factor product when both sides are split at the same qubit boundaries
+        if isinstance(other, KroneckerMatrix) and len(other.factors) == len(self.factors):
+            for i in range(len(self.factors)):
+                if self.factors[i].get_shape()[1] != other.factors[i].get_shape()[0]:
+                    return None
+            return KroneckerMatrix([self.factors[i] * other.factors[i] for i in range(len(self.factors))])
+        return None
+
+#Product of a chain of operators that is kept unmultiplied. Factors are listed in the order they are applied to a state, so the
+#product is factors[-1] * ... * factors[0]. This is cheaper than forming the full operator when it is only applied to a few states
+class ProductMatrix(StructuredMatrix):
+    def __init__(self, factors):
+        StructuredMatrix.__init__(self)
+        self.factors = list(factors)
+
+    def get_shape(self):
+        return (self.factors[-1].get_shape()[0], self.factors[0].get_shape()[1])
+
+    def build_array(self):
+        return ProductMatrix.multiply_chain(self.factors).to_array()
+
+    def apply_array(self, v):
+        for f in self.factors:
+            v = f.apply_array(v)
+        return v
+
+    def left_apply_array(self, m):
+        for f in reversed(self.factors):
+            m = f.left_apply_array(m)
+        return m
+
+    def apply_cost(self, columns):
+        cost = 0.0
+        for f in self.factors:
+            cost += f.apply_cost(columns)
+        return cost
+
+    #Classic matrix-chain dynamic program over the factor shapes. Multiplying a single (possibly structured) factor into a dense
+    #product is costed as applying that factor, anything else as a dense product. Returns [cost, split] where split[i][j] is the
+    #factor after which the chain i..j is divided
+    @staticmethod
+    def chain_order(factors):
+        count = len(factors)
+        rows = [f.get_shape()[0] for f in factors]
+        cols = [f.get_shape()[1] for f in factors]
+        cost = [[0.0 for j in range(count)] for i in range(count)]
+        split = [[i for j in range(count)] for i in range(count)]
+        for length in range(2, count + 1):
+            for i in range(count - length + 1):
+                j = i + length - 1
+                best = None
+                for s in range(i, j):
+                    #Left operand is factors s+1..j with shape (rows[j], rows[s]), right operand is factors i..s with shape (rows[s], cols[i])
+                    if s + 1 == j:
+                        product = factors[j].apply_cost(cols[i])
+                    elif s == i:
+                        product = factors[i].apply_cost(rows[j])
+                    else:
+                        product = float(rows[j]) * rows[s] * cols[i]
+                    total = cost[i][s] + cost[s + 1][j] + product
+                    if best is None or total < best:
+                        best = total
+                        split[i][j] = s
+                cost[i][j] = best
+        return [cost[0][count - 1], split]
+
+    #Multiplies a chain of factors (in application order) in the order with the lowest estimated cost
+    @staticmethod
+    def multiply_chain(factors):
+        split = ProductMatrix.chain_order(factors)[1]
+        return ProductMatrix.multiply_range(factors, split, 0, len(factors) - 1)
+
+    @staticmethod
+    def multiply_range(factors, split, i, j):
+        if i == j:
+            return factors[i]
+        s = split[i][j]
+        return ProductMatrix.multiply_range(factors, split, s + 1, j) * ProductMatrix.multiply_range(factors, split, i, s)
@@ -0,0 +1,201 @@
+import numpy as np
+import math
+import heapq
+#A network of tensors joined by labelled legs. Every leg label is shared by exactly two tensors (a bond, which is summed over) or
+#belongs to one tensor only (an open leg, which is kept in the result). Contracting the network pairwise in a good order keeps the
+#intermediate tensors small, which is far cheaper than spanning every live wire as layered matrices do
+class Tensor_Network:
+    #Networks with at most this many tensors are ordered by an exact dynamic program over subsets, larger networks greedily
+    dp_limit = 6
+
+    def __init__(self):
+        self.tensors = []
+        self.legs = []
+        #Dimension of each leg label
+        self.dims = {}
+
+    #Adds a tensor. legs lists the label of each axis of the ndarray
+    def add_tensor(self, tensor, legs):
+        tensor = np.asarray(tensor)
+        if len(legs) != tensor.ndim:
+            print("Warning! Tensor with " + str(tensor.ndim) + " axes given " + str(len(legs)) + " legs!")
+        for axis in range(len(legs)):
+            self.dims[legs[axis]] = tensor.shape[axis]
+        self.tensors.append(tensor)
+        self.legs.append(list(legs))
+
+    def get_size(self):
+        return len(self.tensors)
+
+    #Bit masks of each tensor's legs, with the log2 dimension of every leg bit
+    def leg_masks(self):
+        bits = {}
+        weights = []
+        masks = []
+        for legs in self.legs:
+            mask = 0
+            for leg in legs:
+                if leg not in bits:
+                    bits[leg] = len(weights)
+                    weights.append(math.log2(self.dims[leg]))
+                mask ^= 1 << bits[leg]
+            masks.append(mask)
+        return [masks, weights]
+
+    #Log2 of the number of entries of a tensor with the legs in mask
+    @staticmethod
+    def log_size(mask, weights):
+        size = 0.0
+        bit = 0
+        while mask:
+            if mask & 1:
+                size += weights[bit]
+            mask >>= 1
+            bit += 1
+        return size
+
+    #Finds a pairwise contraction order. Returns [cost, pairs] where cost estimates the multiply-adds needed and pairs lists the contractions
+    #as pairs of positions in the list of tensors still to be contracted, the result being appended to the end of the list
+    def contraction_order(self):
+        masks, weights = self.leg_masks()
+        if len(masks) <= 1:
+            return [0.0, []]
+        if len(masks) <= Tensor_Network.dp_limit:
+            return Tensor_Network.dp_order(masks, weights)
+        return Tensor_Network.greedy_order(masks, weights)
+
+    #Exact order over subsets of tensors. Contracting two groups costs the product of the dimensions of all of their legs, and the legs
+    #left open by a group are the XOR of its tensors' masks, since a bond appears in exactly two tensors
+    @staticmethod
+    def dp_order(masks, weights):
+        count = len(masks)
+        full = (1 << count) - 1
+        open_legs = [0] * (full + 1)
+        for subset in range(1, full + 1):
+            low = subset & -subset
+            open_legs[subset] = open_legs[subset ^ low] ^ masks[low.bit_length() - 1]
+        cost = [0.0] * (full + 1)
+        split = [0] * (full + 1)
+        for subset in range(1, full + 1):
+            if subset & (subset - 1) == 0:
+                continue
+            best = None
+            #Each split is visited once by requiring the lowest tensor to be on the left
+            low = subset & -subset
+            left = (subset - 1) & subset
+            while left > 0:
+                if left & low:
+                    right = subset ^ left
+                    total = cost[left] + cost[right] + math.pow(2.0, Tensor_Network.log_size(open_legs[left] | open_legs[right], weights))
+                    if best is None or total < best:
+                        best = total
+                        split[subset] = left
+                left = (left - 1) & subset
+            cost[subset] = best
+        #Replay the splits as positional pairs
+        pairs = []
+        Tensor_Network.replay(full, split, list(range(count)), pairs)
+        return [cost[full], pairs]
+
+    #Appends the contractions for a subset to pairs. live lists the subset (as a tensor or a contracted group) at each position of the
+    #list of tensors still to be contracted. Returns the position of the subset's result
+    @staticmethod
+    def replay(subset, split, live, pairs):
+        if subset & (subset - 1) == 0:
+            return live.index(subset.bit_length() - 1)
+        left = split[subset]
+        right = subset ^ left
+        Tensor_Network.replay(left, split, live, pairs)
+        Tensor_Network.replay(right, split, live, pairs)
+        i = live.index(Tensor_Network.group(left))
+        j = live.index(Tensor_Network.group(right))
+        pairs.append([i, j])
+        for k in sorted([i, j], reverse=True):
+            del live[k]
+        live.append(Tensor_Network.group(subset))
+        return len(live) - 1
+
+    #Identifier of a tensor (its index) or a contracted group (its subset mask, negated) in replay
+    @staticmethod
+    def group(subset):
+        if subset & (subset - 1) == 0:
+            return subset.bit_length() - 1
+        return -subset
+
+    #Greedy order: repeatedly contract the pair of tensors sharing a leg whose result shrinks the network most, then join any
+    #disconnected pieces smallest first
+    #Tensors are numbered as they are made, a contraction's result taking the next number. The costs of the pairs sharing a leg are kept
+    #in a heap, pushing the new tensor's pairs after each contraction, and pairs naming an already contracted tensor are dropped as they
+    #are popped, so pairs are not rescanned every step
+    @staticmethod
+    def greedy_order(masks, weights):
+        masks = list(masks)
+        sizes = [math.pow(2.0, Tensor_Network.log_size(mask, weights)) for mask in masks]
+        alive = [True] * len(masks)
+        #Numbers of the tensors still to be contracted, by position
+        live = list(range(len(masks)))
+        heap = []
+        for a in range(len(masks)):
+            for b in range(a + 1, len(masks)):
+                if masks[a] & masks[b]:
+                    heap.append([Tensor_Network.greedy_score(a, b, masks, sizes, weights), a, b])
+        heapq.heapify(heap)
+        cost = 0.0
+        pairs = []
+        while len(live) > 1:
+            best_pair = None
+            while len(heap) > 0:
+                score, a, b = heapq.heappop(heap)
+                if alive[a] and alive[b]:
+                    best_pair = [a, b]
+                    break
+            if best_pair is None:
+                #No shared legs remain, so take an outer product of the two smallest tensors
+                best_pair = sorted(live, key=lambda k: sizes[k])[:2]
+            i, j = sorted(live.index(k) for k in best_pair)
+            a = live[i]
+            b = live[j]
+            cost += math.pow(2.0, Tensor_Network.log_size(masks[a] | masks[b], weights))
+            pairs.append([i, j])
+            del live[j]
+            del live[i]
+            alive[a] = False
+            alive[b] = False
+            merged = len(masks)
+            masks.append(masks[a] ^ masks[b])
+            sizes.append(math.pow(2.0, Tensor_Network.log_size(masks[merged], weights)))
+            alive.append(True)
+            for k in live:
+                if masks[k] & masks[merged]:
+                    heapq.heappush(heap, [Tensor_Network.greedy_score(k, merged, masks, sizes, weights), k, merged])
+            live.append(merged)
+        return [cost, pairs]
+
+    #Change in the number of entries from contracting tensors a and b, see greedy_order
+    @staticmethod
+    def greedy_score(a, b, masks, sizes, weights):
+        return math.pow(2.0, Tensor_Network.log_size(masks[a] ^ masks[b], weights)) - sizes[a] - sizes[b]
+
+    #Estimated number of multiply-adds to contract the network
+    def contraction_cost(self):
+        return self.contraction_order()[0]
+
+    #Contracts the network. Returns the resulting ndarray with its axes in the order of open_legs
+    def contract(self, open_legs):
+        tensors = list(self.tensors)
+        legs = [list(l) for l in self.legs]
+        for i, j in self.contraction_order()[1]:
+            shared = [leg for leg in legs[i] if leg in legs[j]]
+            t = np.tensordot(tensors[i], tensors[j], axes=([legs[i].index(leg) for leg in shared], [legs[j].index(leg) for leg in shared]))
+            l = [leg for leg in legs[i] if leg not in shared] + [leg for leg in legs[j] if leg not in shared]
+            for k in sorted([i, j], reverse=True):
+                del tensors[k]
+                del legs[k]
+            tensors.append(t)
+            legs.append(l)
+        if len(tensors) == 0:
+            return np.ones(())
+        result = tensors[0]
+        if sorted(legs[0], key=str) != sorted(open_legs, key=str):
+            print("Warning! Contracted network has legs " + str(legs[0]) + " rather than " + str(open_legs))
+        return np.transpose(result, [legs[0].index(leg) for leg in open_legs])
@@ -1,4 +1,6 @@
 from CMatrix import *
+from StructuredMatrix import *
+from LRUCache import LRU_Cache
 import math
 import cmath
 def enum(**named_values):
@@ -8,6 +10,10 @@ def enum(**named_values):
 class ZXNode:
     Function_Set = enum(H = "H", R = "R", G = "G")
 
+    #Operators are shared by every node through a bounded cache keyed on (function, phase, inputs, outputs, controlled)
+    #See calculate_operator. Cached operators are frozen (read-only) so they are handed out without copying
+    operator_cache = LRU_Cache(4096)
+
     #A is max inputs, r is max outputs
     def __init__(self, x, y, a, r):
         self.a = a;
@@ -112,31 +118,74 @@ class ZXNode:
 
     #Calculates a Complex Matrix CMatrix (see CMatrix.py for usage) for a fixed number of inputs and outputs using the nodes current phase and function
     #See function specific methods calculate_green(i,o), calculate_red(i,o) and calculate_hadamard(i,o) for more details
+    #The operator is looked up in ZXNode.operator_cache first and must not be modified
     def calculate_operator(self, inputs, outputs):
+        return ZXNode.operator(self.function, self.phase, inputs, outputs, self.controlled)
+
+    #Gets the operator of a node with the given settings from ZXNode.operator_cache, building it on a miss
+    #The operator is built from the quantised phase of the key rather than the phase given, so an entry is the same whichever of the
+    #phases sharing its key was met first, and a cached operator is identical to a rebuilt one
+    @staticmethod
+    def operator(function, phase, inputs, outputs, controlled):
+        key = ZXNode.operator_key(function, phase, inputs, outputs, controlled)
+        operator = ZXNode.operator_cache.get(key)
+        if operator is None:
+            operator = ZXNode.build_operator(function, ZXNode.quantise_phase(phase), inputs, outputs, controlled)
+            if operator is not None:
+                ZXNode.operator_cache.put(key, operator.freeze())
+        return operator
+
+    #Key identifying the operator of a node. Settings which do not change the operator are dropped: Hadamards ignore phase and the control
+    #flag only matters for square nodes with more than 1 qubit. Phases are taken modulo 2pi and quantised to 12 decimal places, so the
+    #multiples of 2pi / k produced by phase resets share an entry however they were calculated
+    @staticmethod
+    def operator_key(function, phase, inputs, outputs, controlled):
+        controlled = controlled and inputs == outputs and inputs != 1
+        if function is ZXNode.Function_Set.H:
+            return (function, None, inputs, outputs, controlled)
+        return (function, ZXNode.quantise_phase(phase), inputs, outputs, controlled)
+
+    @staticmethod
+    def quantise_phase(phase):
+        p = round(float(phase) % (math.pi * 2.0), 12)
+        if p == round(math.pi * 2.0, 12):
+            p = 0.0
+        return p
+
+    #Gets the shared operator cache, e.g. to read its hit and miss counters
+    @staticmethod
+    def get_operator_cache():
+        return ZXNode.operator_cache
+
+    #Builds the operator for ZXNode.operator without consulting the cache
+    @staticmethod
+    def build_operator(function, phase, inputs, outputs, controlled):
         #Controlled only matters if the node is 'square' with more than 1 qubit
-        if(self.controlled and inputs == outputs and inputs != 1):
+        if(controlled and inputs == outputs and inputs != 1):
             #Generate a 1x1 matrix and place it in a controlled matrix
-            return ZXNode.generate_controlled(inputs - 1, self.calculate_operator(1, 1))
-        if self.function is ZXNode.Function_Set.H:
+            return ZXNode.generate_controlled(inputs - 1, ZXNode.operator(function, phase, 1, 1, False))
+        if function is ZXNode.Function_Set.H:
             #Calculate Hadamard CMatrix
             return ZXNode.calculate_hadamard(inputs, outputs)
-        elif self.function is ZXNode.Function_Set.R:
+        elif function is ZXNode.Function_Set.R:
             #Calculate Red Node CMatrix
-            return self.calculate_general_red(inputs, outputs, self.phase)
+            return ZXNode.calculate_general_red(inputs, outputs, phase)
         else:
             #Default calculate Green Node CMatrix
-            return ZXNode.calculate_general_green(inputs, outputs, self.phase)
+            return ZXNode.calculate_general_green(inputs, outputs, phase)
 
     #Generates Complex Matrix representation of a Hadamard node for a fixed number of inputs and outputs
     #We interpret this as Green(1, outputs, 0 phase) * conventional Hadamard Matrix * Green(inputs, 1, 0 phase)
     #E.g. Green splitters on either side of a conventional Hadamard (1/root(2) [[1, 1],[1, -1]]) and 1-input 1-output scenarios then generating
     #A conventional hadamard operation as Green(1, 1, 0 phase) is effectively a wire
+    #The green splitters only keep the |0...0> and |1...1> corners, so the result is a SpiderMatrix whose core is the Hadamard matrix itself,
+    #cut down to its first row when there are no outputs and its first column when there are no inputs (the 0 phase destructor and generator)
     @staticmethod
     def calculate_hadamard(inputs, outputs):
-        inmatrix = ZXNode.calculate_general_green(inputs, 1, 0.0)
-        outmatrix = ZXNode.calculate_general_green(1, outputs, 0.0)
-        h = ZXNode.generate_hadamard_matrix()
-        return outmatrix * h * inmatrix
+        h = ZXNode.generate_hadamard_matrix().to_array()
+        rows = [0] if outputs == 0 else [0, 1]
+        cols = [0] if inputs == 0 else [0, 1]
+        return SpiderMatrix(inputs, outputs, h[np.ix_(rows, cols)])
 
     #Generates a conventional 1-input, 1-output Matrix of a Hadamard gate
     @staticmethod
@@ -145,7 +194,7 @@ class ZXNode:
 
     #Generates a CMatrix for a Green Node for a certain number of inputs, outputs and phase.
     #This is a 2^input width * 2^input high Complex Matrix with all elements set to 0 except the first (0, 0) = 1 + 0i
-    #And the last (2^input, 2^output) = e ^ (i * phase)
+    #And the last (2^input, 2^output) = e ^ (i * phase). It is returned as a SpiderMatrix (see StructuredMatrix.py) holding only those corners
     #All generator cases (0 inputs) are resolved in the green operator as both Hadamard & Red with 0 inputs
     #Are instantiated using a 0 input Green (in Hadamard, we have 0-in, 1-out Green followed by H, followed by 1-in, O-out Green)
     #(in Red, we have 0 x H = [[1.0 + 0j]] then 0-in, O-out Green, then O x H masking the output).
@@ -156,9 +205,6 @@ class ZXNode:
     #Prespecified size without producing an error when an input is unused (e.g. has 0 outputs).
     @staticmethod
     def calculate_general_green(inputs, outputs, phasein):
-        inbits = int(math.pow(2,inputs))
-        outbits = int(math.pow(2,outputs))
-
         #By the nature of ZX_CGP, there is never a 0-in, 0-out case as 0-out can only occur in input nodes which
         #Are inherently 1-in. If you are designing a system where these may occur please adjust this catchment accordingly
         if inputs == 0 and outputs == 0:
@@ -168,67 +214,45 @@ class ZXNode:
         #Catch the generator case
         if inputs == 0:
             #Generator has cos(phase) |0 ^ O> + sin(phase) |1 ^ O> e.g. all other mixed states have p = 0
-            matrix = [[0 + 0j for y in range(outbits)]]
-            #|0 ^ O> state
-            matrix[0][0] = math.cos(phasein) + 0j
-            #|1 ^ O> state
-            matrix[0][outbits - 1] = math.sin(phasein) + 0j
-            return CMatrix(matrix)
+            #Core column holds the |0 ^ O> and |1 ^ O> states
+            return SpiderMatrix(inputs, outputs, [[math.cos(phasein) + 0j], [math.sin(phasein) + 0j]])
 
         #Catch the destructor case
         if outputs == 0:
             #Destructors are inherently not trace preserving. In fact, a 0 phase destructor will only store states where the destroyed
             #Qubit has value |0>, so if all states are in the |1> case, then the resultant QState is literally empty
-            matrix = [[0 + 0j] for x in range(inbits)]
-            #|0 ^ I> state
-            matrix[0][0] = math.cos(phasein) + 0j
-            #|1 ^ I> state
-            matrix[inbits - 1][0] = math.sin(phasein) + 0j
+            #Core row holds the |0 ^ I> and |1 ^ I> states
             #Since these square sum to 1 this cannot be trace increasing
-            return CMatrix(matrix)
+            return SpiderMatrix(inputs, outputs, [[math.cos(phasein) + 0j, math.sin(phasein) + 0j]])
 
             
-        #Matrices are stored column by column
-        matrix = [[0 + 0j for y in range(outbits)] for x in range(inbits)]
-        #Top left element is simply 1
-        matrix[0][0] = 1 + 0j
-        #Bottom right element is e ^ (i * phase)
-        matrix[inbits - 1][outbits - 1] = cmath.exp(float(phasein) * 1j)
-        return CMatrix(matrix)
+        #Only the corners are stored. Top left element is simply 1, bottom right element is e ^ (i * phase)
+        return SpiderMatrix(inputs, outputs, [[1 + 0j, 0j], [0j, cmath.exp(float(phasein) * 1j)]])
 
     #Generates a CMatrix for a Red node for a certain number of inputs, outputs and phase
     #This is generally interpreted as a layer of Hadamards on either side of a green node performing the same in,out,phase function
     #For more information see ZX Calculus literature
+    #Rather than multiplying by H^inputs and H^outputs, the red node is the green node's corners taken in the Hadamard basis, which
+    #RedSpiderMatrix (see StructuredMatrix.py) builds and applies by index arithmetic
     @staticmethod
     def calculate_general_red(inputs,outputs,phase):
-        h = ZXNode.generate_hadamard_matrix()
-
-        #Set up in and out matrices
-        inmatrix = CMatrix([[1 + 0j]])
-        outmatrix = CMatrix([[1 + 0j]])
-
-        #Expand in and out matrices as a hadamard gate for each input and output
-        for i in range(inputs):
-            #Backslash operator indicates tensor product
-            inmatrix = inmatrix / h
-        for j in range(outputs):
-            outmatrix = outmatrix / h
-
         green = ZXNode.calculate_general_green(inputs, outputs,phase)
-        return outmatrix * green * inmatrix
+        if green is None:
+            return None
+        return RedSpiderMatrix(inputs, outputs, green.core)
 
+    #Places a 2x2 controlled matrix in the bottom right of an identity over control_bits + 1 qubits, without building the identity
     @staticmethod
     def generate_controlled(control_bits, controlled_matrix):
         size = int(math.pow(2, control_bits + 1))
-        M = [[0 + 0j for x in range(size)] for y in range(size)]
-        #Set all diagnol bits to 1
-        for i in range(size - 2):
-            M[i][i] = 1 + 0j
-        M[size - 2][size - 2] = controlled_matrix.get_raw_data()[0][0]
-        M[size - 2][size - 1] = controlled_matrix.get_raw_data()[0][1]
-        M[size - 1][size - 2] = controlled_matrix.get_raw_data()[1][0]
-        M[size - 1][size - 1] = controlled_matrix.get_raw_data()[1][1]
-        return CMatrix(M)
+        #A diagonal controlled matrix (e.g. a green phase) gives a diagonal operator
+        c = controlled_matrix.to_array()
+        if c[0][1] == 0 and c[1][0] == 0:
+            diagonal = np.ones(size, dtype=np.complex128)
+            diagonal[size - 2] = c[0][0]
+            diagonal[size - 1] = c[1][1]
+            return DiagonalMatrix(diagonal)
+        return ControlledMatrix(control_bits, c)
 
 
 inp = int(1)
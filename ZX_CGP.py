@@ -1,4 +1,7 @@
 from ZXNode import *
+from ZX_Genome import *
+from ZX_Diagram import *
+from StabilizerSum import *
 from EdgePointer import *
 import random
 import math
@@ -7,6 +10,9 @@ from random import gauss
 #Defines a CGP grid that can be evolved by some evolutionary algorithm
 #Includes a method for converting said CGP grid into a QuantumSystem based on its active nodes
 class ZX_CGP:
+        #Whether every mutation first checks the incrementally maintained active set against a full active pass (see verify_active_set)
+        verify_active = False
+
         #Params:
         #i, number of inputs
         #n, number of layers in grid
@@ -26,65 +32,50 @@ class ZX_CGP:
 
             #Whether this individual phenotypically changed as a result of mutations applied. Initially false
             self.changed = False
+            #Memoised phenotype key, see get_phenotype
+            self.phenotype = None
 
-            #Build grid
-
-            #Layer 0 is inputs, Layer n + 1 is outputs
-            self.grid = []
-
-            #Build inputs
-            inputs = []
-            for input in range(i):
-                inputs.append(ZXNode(0, input, 0, r))
-
-            self.grid.append(inputs)
-
-            #Build main grid
-            for l in range(n):
-                layer = []
-                for node in range(m):
-                    layer.append(ZXNode(l + 1, node, a, r))
-                self.grid.append(layer)
-
-            #Build outputs
-            outputs = []
-            for output in range(o):
-                node = ZXNode(n + 1, output, 1, 0)
-                #Outputs are inherently active
-                node.set_active(True)
-                outputs.append(node)
-
-            self.grid.append(outputs)
+            #Nodes and edges are held in flat typed arrays (see ZX_Genome.py), layer 0 being the inputs and layer n + 1 the outputs
+            #Nodes are accessed through ZXNodeView objects, made on demand and kept in views
+            self.genome = ZX_Genome(i, n, m, o, a, r, c)
+            self.views = [None] * self.genome.size
+            #Undo journal of mutations, None when not recording (see start_journal)
+            self.journal = None
 
+        #Copies the individual. The genome arrays are copied wholesale, so no nodes or edge pointers are rebuilt
         def copy(self):
-            new = ZX_CGP(self.i,self.n,self.m,self.o,self.a,self.r,self.c)
-
-            #Copy each input
-            for input in range(self.i):
-                source_node = self.get_node(0, input)
-                target_node = new.get_node(0, input)
-
-                #Copy
-                self.copy_node(source_node, target_node)
-
-            # Copy each node
-            for x in range(self.n):
-                for y in range(self.m):
-                    source_node = self.get_node(x + 1, y)
-                    target_node = new.get_node(x + 1, y)
-
-                    #Copy
-                    self.copy_node(source_node, target_node)
-
-            # Copy each output
-            for output in range(self.o):
-                source_node = self.get_node(self.n + 1, output)
-                target_node = new.get_node(self.n + 1, output)
-
-                # Copy
-                self.copy_node(source_node, target_node)
+            new = ZX_CGP.__new__(ZX_CGP)
+            new.i = self.i
+            new.n = self.n
+            new.m = self.m
+            new.o = self.o
+            new.a = self.a
+            new.r = self.r
+            new.c = self.c
+            new.changed = False
+            new.phenotype = self.phenotype
+            new.genome = self.genome.copy()
+            new.views = [None] * new.genome.size
+            new.journal = None
+            return new
 
-            new.active_pass()
+        #Builds an individual around an existing genome, e.g. one sent to another process (see ParallelEvaluation.py). The dimensions
+        #are the genome's and the complexity limit its width cap
+        @staticmethod
+        def from_genome(genome):
+            new = ZX_CGP.__new__(ZX_CGP)
+            new.i = genome.i
+            new.n = genome.n
+            new.m = genome.m
+            new.o = genome.o
+            new.a = genome.a
+            new.r = genome.r
+            new.c = genome.cap
+            new.changed = False
+            new.phenotype = None
+            new.genome = genome
+            new.views = [None] * genome.size
+            new.journal = None
             return new
 
         def copy_node(self, source, target):
@@ -106,13 +97,139 @@ class ZX_CGP:
                 return None
             return EPointer(e.get_x(), e.get_y(), e.get_z())
         
+        #The grid as a list of layers of nodes, layer 0 being the inputs and layer n + 1 the outputs
+        @property
+        def grid(self):
+            return [[self.get_node(x, y) for y in range(self.genome.layer_size(x))] for x in range(self.n + 2)]
+
         def __str__(self):
             ret = ""
-            for i in range(len(self.grid)):
-                for j in range(len(self.grid[i])):
-                    ret = ret + str(self.grid[i][j]) + "\n"
+            grid = self.grid
+            for i in range(len(grid)):
+                for j in range(len(grid[i])):
+                    ret = ret + str(grid[i][j]) + "\n"
             return ret
 
+        #Records that the phenotype may have changed, e.g. after a mutation to an active part of the graph
+        def mark_changed(self):
+            self.changed = True
+            self.phenotype = None
+
+        #Starts recording an undo journal: while recording, mutations note the node fields and edges they overwrite so they can be undone
+        #in place (see checkpoint and rollback) rather than recopying the individual and replaying every mutation
+        def start_journal(self):
+            self.journal = []
+
+        #Stops recording the undo journal and discards it
+        def stop_journal(self):
+            self.journal = None
+
+        #Gets a checkpoint of the journal to roll back to
+        def checkpoint(self):
+            return [len(self.journal), self.changed, self.phenotype]
+
+        #Undoes every mutation journaled since a checkpoint, most recent first
+        def rollback(self, checkpoint):
+            genome = self.genome
+            journal = self.journal
+            while len(journal) > checkpoint[0]:
+                entry = journal.pop()
+                if entry[0] == "node":
+                    node = entry[1]
+                    genome.function[node] = entry[2]
+                    genome.phase[node] = entry[3]
+                    genome.controlled[node] = entry[4]
+                else:
+                    in_slot, old_source, out_slot, old_target = entry[1:]
+                    #Remove the new edge, then reconnect the edges it replaced, whose slots it freed
+                    genome.disconnect(in_slot)
+                    if old_source >= 0:
+                        genome.connect(old_source, in_slot)
+                    if old_target >= 0:
+                        genome.connect(out_slot, old_target)
+            self.changed = checkpoint[1]
+            self.phenotype = checkpoint[2]
+
+        #Journals the function, phase and control flag of a node before it is mutated
+        def journal_node(self, node):
+            if self.journal is not None:
+                genome = self.genome
+                self.journal.append(["node", node, genome.function[node], genome.phase[node], genome.controlled[node]])
+
+        #Journals the edges into an input slot and from an output slot (-1 for none) before they are replaced
+        def journal_edge(self, in_slot, out_slot):
+            if self.journal is not None:
+                genome = self.genome
+                old_target = genome.out_edges[out_slot] if out_slot >= 0 else -1
+                self.journal.append(["edge", in_slot, genome.in_edges[in_slot], out_slot, old_target])
+
+        #Gets a canonical key of the phenotype: two individuals with equal keys build the same system, wherever their active nodes sit in the grid
+        #The key is memoised until the individual is changed (see mark_changed)
+        def get_phenotype(self):
+            if self.phenotype is None:
+                self.phenotype = self.calculate_phenotype()
+            return self.phenotype
+
+        #Builds the phenotype key. Active nodes are labelled in depth first order from the outputs, following inputs in slot order, and inputs
+        #are labelled by their index. Each node is described by its operator key (see ZXNode.operator_key), which drops settings that do not
+        #change its operator, and by the label and output rank of the source feeding each of its connected inputs in order, the rank being the
+        #position of the source's output among its active outputs. Inputs are described by operator key only, so inactive inputs are counted
+        def calculate_phenotype(self):
+            genome = self.genome
+            active = genome.active
+            in_edges = genome.in_edges
+            out_edges = genome.out_edges
+            a = genome.a
+            r = genome.r
+            first_output = genome.first_output()
+
+            labels = {}
+            for input in range(self.i):
+                labels[input] = -(input + 1)
+            order = []
+            stack = list(range(genome.size - 1, first_output - 1, -1))
+            while len(stack) > 0:
+                node = stack.pop()
+                if node in labels:
+                    continue
+                labels[node] = len(order)
+                order.append(node)
+                for slot in range((node * a) + genome.input_count(node) - 1, (node * a) - 1, -1):
+                    source = in_edges[slot]
+                    if source >= 0:
+                        stack.append(source // r)
+
+            key = []
+            for input in range(self.i):
+                key.append(ZXNode.operator_key(genome.function_of(input), genome.phase[input], 1, genome.fan_out[input], genome.controlled[input] == 1))
+            for node in order:
+                wiring = []
+                for slot in range(node * a, (node * a) + genome.input_count(node)):
+                    source = in_edges[slot]
+                    if source >= 0:
+                        source_node = source // r
+                        rank = 0
+                        for earlier in range(source_node * r, source):
+                            target = out_edges[earlier]
+                            if target >= 0 and active[target // a] == 1:
+                                rank += 1
+                        wiring.append((labels[source_node], rank))
+                outputs = 1 if node >= first_output else genome.fan_out[node]
+                key.append((ZXNode.operator_key(genome.function_of(node), genome.phase[node], genome.fan_in[node], outputs, genome.controlled[node] == 1), tuple(wiring)))
+            return tuple(key)
+
+        #Gets a key of the layout of the active graph: the id, function, quantised phase, control flag and input edges of every input and
+        #active node. Individuals with equal layouts build identical systems bit for bit, whereas individuals with equal phenotypes may
+        #place their nodes differently in the grid and so multiply their layers in a different order (see QSystem.compile)
+        def get_layout(self):
+            genome = self.genome
+            key = []
+            for node in range(genome.size):
+                if genome.active[node] == 1 or node < genome.i:
+                    edges = tuple(genome.in_edges[node * genome.a:(node + 1) * genome.a])
+                    key.append((node, genome.function[node], ZXNode.quantise_phase(genome.phase[node]), genome.controlled[node], edges))
+            return tuple(key)
+
         #Method to count number of inactive inputs in the system. This is an important notion for training a system to be a function of
         #Its inputs
         def count_inactive_inputs(self):
@@ -123,38 +240,69 @@ class ZX_CGP:
             return count
 
         #Mutate the grid a certain number of times
-        def mutate(self, num_mutations, phase_variance, phase_reset_granularity, disconnect_rate, phase_reset_rate):
+        #If bounded, a mutation which takes the graph over its complexity limit is undone in place and redrawn (see start_journal), so
+        #a graph within the limit stays within it
+        def mutate(self, num_mutations, phase_variance, phase_reset_granularity, disconnect_rate, phase_reset_rate, bounded=False):
             self.changed = False
+            journaling = bounded and self.journal is None
+            if journaling:
+                self.start_journal()
             for mut in range(num_mutations):
-                #Once mutated, do an active pass. This is expensive and could be optimized, but relative to
-                #Quantum complexity this is arbitrary at higher numbers of qubits (max complexity)
-                self.active_pass()
+                #Active nodes are kept up to date by the genome as edges change (see ZX_Genome.py)
+                if ZX_CGP.verify_active:
+                    self.verify_active_set()
                 #Keep retrying until mutation is successful
                 success = False
                 while not success:
+                    if bounded:
+                        checkpoint = self.checkpoint()
                     #Pick a node. Can be hidden or output, not input (which is linear)
                     y = 1 + random.randint(0, self.n)
-                    x = random.randint(0, len(self.grid[y]) - 1)
-                    success = self.mutate_node(self.grid[y][x], phase_variance, phase_reset_granularity, disconnect_rate, phase_reset_rate)
+                    x = random.randint(0, self.genome.layer_size(y) - 1)
+                    success = self.mutate_node(self.get_node(y, x), phase_variance, phase_reset_granularity, disconnect_rate, phase_reset_rate)
+                    if bounded and not self.journaled_within_complexity(checkpoint):
+                        self.rollback(checkpoint)
+                        success = False
+            if journaling:
+                self.stop_journal()
 
         
         #Mutate the grid a certain number of times using a weighted mutation distribution across [edge_change, edge_disconnect, function_change, phase_change, phase_reset, control flip]
-        def mutate_with_weights(self, num_mutations, phase_variance, phase_reset_granularity, mutation_weights):
+        #If bounded, a mutation which takes the graph over its complexity limit is undone in place and redrawn, as in mutate
+        def mutate_with_weights(self, num_mutations, phase_variance, phase_reset_granularity, mutation_weights, bounded=False):
             self.changed = False
-            self.active_pass()
             mutation_counters = [0 for x in range(6)]
+            journaling = bounded and self.journal is None
+            if journaling:
+                self.start_journal()
             for mut in range(num_mutations):
-                #Once mutated, do an active pass. This is expensive and could be optimized, but relative to
-                #Quantum complexity this is arbitrary at higher numbers of qubits (max complexity)
-                self.active_pass()
-                
-                #Pick a node. Can be hidden or output, not input (which is linear)
-                x = 1 + random.randint(0, self.n)
-                y = random.randint(0, len(self.grid[x]) - 1)
-                ret = self.mutate_node_with_weights(self.grid[x][y], phase_variance, phase_reset_granularity, mutation_weights)
+                #Active nodes are kept up to date by the genome as edges change (see ZX_Genome.py)
+                if ZX_CGP.verify_active:
+                    self.verify_active_set()
+
+                while True:
+                    if bounded:
+                        checkpoint = self.checkpoint()
+                    #Pick a node. Can be hidden or output, not input (which is linear)
+                    x = 1 + random.randint(0, self.n)
+                    y = random.randint(0, self.genome.layer_size(x) - 1)
+                    ret = self.mutate_node_with_weights(self.get_node(x, y), phase_variance, phase_reset_granularity, mutation_weights)
+                    if not bounded or self.journaled_within_complexity(checkpoint):
+                        break
+                    self.rollback(checkpoint)
                 mutation_counters[ret[1]] += 1
+            if journaling:
+                self.stop_journal()
             return mutation_counters
 
+        #Whether the graph is still within its complexity limit after the mutations journaled since a checkpoint. Only a new edge can
+        #raise the complexity, so the check is skipped otherwise
+        def journaled_within_complexity(self, checkpoint):
+            for entry in self.journal[checkpoint[0]:]:
+                if entry[0] == "edge" and entry[3] >= 0:
+                    return self.check_complexity()
+            return True
+
         #Function mutates a specific node
         def mutate_node(self, mutation_node, phase_variance, phase_reset_granularity, disconnect_rate, phase_reset_rate):
             #Uniformally, choose between function mutation, edge mutation and phase mutation
@@ -231,13 +379,18 @@ class ZX_CGP:
                 return [True, 5]
 
         def mutate_control(self, mutation_node):
+                self.journal_node(mutation_node.get_id())
                 mutation_node.set_controlled(not mutation_node.get_controlled())
+                #Check if we have updated the active graph
+                if mutation_node.get_active():
+                    self.mark_changed()
 
         #Method mutates the function of a specified node
         #Params are mutation_node, the node to mutate, and phase_reset_granularity; the degree to which phase
         #Should be reset. If the granularity is -1, we do not change the phase
         def mutate_function(self, mutation_node, phase_reset_rate, phase_reset_granularity):
             #Function mutation. Function can have 3 values but we already have 1 so we choose between the other 2
+            self.journal_node(mutation_node.get_id())
 
             if mutation_node.get_function() is ZXNode.Function_Set.H:
                 #Is already hadamard
@@ -273,11 +426,12 @@ class ZX_CGP:
 
             #Check if we have updated the active graph
             if mutation_node.get_active():
-                self.changed = True
+                self.mark_changed()
 
 
         #Method mutates phase for a specific node
         def mutate_phase(self, mutation_node, phase_variance, phase_reset_rate, phase_reset_granularity):
+            self.journal_node(mutation_node.get_id())
             if random.random() < phase_reset_rate:
                     #Reset the phase according to the given granularity
                     factor = float(random.randint(0, int(phase_reset_granularity))) / phase_reset_granularity
@@ -293,25 +447,39 @@ class ZX_CGP:
 
             #Check if we have updated the active graph. Hadamards do not use phase!
             if mutation_node.get_active() and mutation_node.get_function() is not ZXNode.Function_Set.H:
-                self.changed = True
+                self.mark_changed()
 
         #Get the node at a specific coordinate
         def get_node(self, x, y):
-            return self.grid[x][y]
+            return self.get_node_by_id(self.genome.node_id(x, y))
+
+        #Get the node with a specific id (see ZX_Genome.py)
+        def get_node_by_id(self, node):
+            view = self.views[node]
+            if view is None:
+                view = ZXNodeView(self.genome, node)
+                self.views[node] = view
+            return view
+
+        #Get the array-backed genome of the individual
+        def get_genome(self):
+            return self.genome
 
         #Method mutates an edge for a specific node
         def mutate_edge(self, mutation_node, disconnect_rate):
             #Pick an input to change
             input = random.randint(0, mutation_node.get_inputs_size() - 1)
 
+            genome = self.genome
+            node = genome.node_id(mutation_node.get_x(), mutation_node.get_y())
+            in_slot = genome.input_slot(node, input)
+
             #Disconnect case - disconnect the input according to disconnect)rate
             if random.random() < disconnect_rate:
-                        inp = mutation_node.get_input(input)
-                        if inp is not None:
-                            mutation_node.set_input(input, None)
-                            self.get_node(inp.get_x(), inp.get_y()).set_output(inp.get_z(), None)
-                        if mutation_node.get_active() and inp is not None:
-                            self.changed = True
+                        self.journal_edge(in_slot, -1)
+                        source = genome.disconnect(in_slot)
+                        if genome.active[node] == 1 and source >= 0:
+                            self.mark_changed()
                         #Disconnects cannot complexify circuits so a complexity check is unnecessary
                         return True
 
@@ -320,417 +488,239 @@ class ZX_CGP:
                 x = 0
             else:
                 x = random.randint(0, mutation_node.get_x() - 1)
-            y = random.randint(0, len(self.grid[x]) - 1)
-            new_input = self.get_node(x, y)
+            y = random.randint(0, genome.layer_size(x) - 1)
+            new_input = genome.node_id(x, y)
 
             #Pick an output slot in the input node
-            output = random.randint(0, new_input.get_outputs_size() - 1)
-
-            #Aggressively take over that output. Clear old output if any
-            #Store the old edges in case we have to undo the mutation
-            old_edge_source = new_input.get_output(output)
-            mutant_edge_target = mutation_node.get_input(input)
-            #If there was an edge already connected to this slot delete it in its source
-            if old_edge_source is not None:
-                self.get_node(old_edge_source.get_x(), old_edge_source.get_y()).set_input(old_edge_source.get_z(), None)
-            #If there was a node that the mutated edge was connected to, delete it in its target
-            if mutant_edge_target is not None:
-                self.get_node(mutant_edge_target.get_x(), mutant_edge_target.get_y()).set_output(mutant_edge_target.get_z(), None)
-            #Set new input into input slot
-            mutation_node.set_input(input, EPointer(x, y, output))
-            #Take over new input's relevant output slot
-            new_input.set_output(output, EPointer(mutation_node.get_x(), mutation_node.get_y(), input))
-
-##            #Check if the new graph has unreasonable complexity
-##            if not self.check_complexity():
-##                #Complexity of the new circuit is too high. The executed mutation is undone
-##                #Replace the old connections
-##                if old_edge_source is not None:
-##                    self.get_node(old_edge_source.get_x(), old_edge_source.get_y()).set_input(old_edge_source.get_z(), EPointer(x, y, output))
-##                if mutant_edge_target is not None:
-##                    self.get_node(mutant_edge_target.get_x(), mutant_edge_target.get_y()).set_output(mutant_edge_target.get_z(), EPointer(mutation_node.get_x(), mutation_node.get_y(), input))
-##                new_input.set_output(output, old_edge_source)
-##                mutation_node.set_input(input, mutant_edge_target)
-##                return False
-##            else:
+            output = random.randint(0, genome.output_count(new_input) - 1)
+            out_slot = genome.output_slot(new_input, output)
+
             #Check if mutated node is active or if the old connection is active to check if the phenotype has changed
-            is_node_active = mutation_node.get_active()
-            if old_edge_source is not None:
-                    is_old_source_active = self.get_node(old_edge_source.get_x(), old_edge_source.get_y()).get_active()
-            else:
-                    is_old_source_active = False
-            if is_node_active or is_old_source_active:
-                    self.changed = True
+            old_edge_target = genome.out_edges[out_slot]
+            is_node_active = genome.active[node] == 1
+            is_old_target_active = old_edge_target >= 0 and genome.active[old_edge_target // genome.a] == 1
+
+            #Aggressively take over that output. The old edge using that output slot and the old edge into the input slot are disconnected
+            self.journal_edge(in_slot, out_slot)
+            genome.connect(out_slot, in_slot)
+
+            if is_node_active or is_old_target_active:
+                    self.mark_changed()
             return True
 
         #Method checks is a graph exceeds the required complexity by considering the number of active edges at any point in the graph
+        #The genome keeps the number of active edges at every cut up to date as edges change, counting the cuts wider than c, so this is
+        #a lookup (see ZX_Genome.count_wire). ZX_Genome.cut_widths recalculates the widths from scratch
         def check_complexity(self):
-            active = []
-            #Get our initial output connections from the outputs
-            for o in self.grid[self.n + 1]:
-                for input in range(o.get_inputs_size()):
-                    inp = o.get_input(input)
-                    if inp is not None:
-                        active.append(inp)
-
-            #If active is bigger than the max complexity, then the check fails
-            if len(active) > self.c:
-                return False
-
-            l = self.n + 1
-            #Iterate from back to front, layer by layer, removing nodes that are present from the active list and adding their inputs
-            while l > 0:
-                active_nodes = []
-                new_active = []
-                #Check every currently considered node to see if it is in this layer
-                for node in active:
-                    #x coordinate check - is the node we're looking for in this layer?
-                    if node.get_x() == l:
-                        #Node is found in this layer. Add it to active nodes
-                        active_nodes.append(node)
-                    else:
-                        #Node is not found in this layer. Add it to new_active so that it is checked next layer
-                        new_active.append(node)
-
-                #Iterate through every active node in this layer, removing duplicates and adding children to new active so that they are checked next layer
-
-                #To remove duplicates create a string list to abuse python's set function with
-                string_active = []
-                for a in active_nodes:
-                    string_active.append(str(a.get_x()) + ":" + str(a.get_y()))
-                reduced = list(set(string_active))
-
-                #Use this set to induce active elements created by active nodes in this layer
-                for a in reduced:
-                    sp = a.split(":")
-                    x = sp[0]
-                    y = sp[1]
-                    anode = self.get_node(int(x), int(y))
-                    for i in range(anode.get_inputs_size()):
-                        if anode.get_input(i) is not None:
-                            new_active.append(anode.get_input(i))
-
-                #Copy new active list over
-                active = new_active
-
-                #Check complexity of the next active list
-                if len(new_active) > self.c:
-                    return False
-                l = l - 1
-            return True
+            genome = self.genome
+            #c may have been changed since the genome was made
+            if genome.cap != self.c:
+                genome.set_cap(self.c)
+            return genome.over_cap == 0
 
         #Builds a matrix equivalent of the zx graph expressed in the phenotype
-        #This (bloated) method treats the individual as a ZX Graph by simply ignoring inactive nodes as it iterates
+        #This method treats the individual as a ZX Graph by simply ignoring inactive nodes as it iterates
         #Through the graph, replacing each node with its matrix equivalent and resolving connections using the construct_connection_matrix method
-        def generate_qsystem(self):
-            #Ensure we have an up-to-date notion of which nodes are active
-            self.active_pass()
+        #Edges are identified by their target input slot code (see ZX_Genome.py). The edges leaving each layer are held in wire order in
+        #unresolved_inputs, with a dictionary from edge to wire position, so resolving a node's inputs is a lookup rather than a search
+        #states optionally gives the number of states the system will be applied to, allowing compilation to keep a factored product (see QSystem.compile)
+        def generate_qsystem(self, states=None):
+            genome = self.genome
+            active = genome.active
+            in_edges = genome.in_edges
+            out_edges = genome.out_edges
+            a = genome.a
+            r = genome.r
 
             #See QuantumSystem.py for usage
             qs = QSystem()
-            grid = self.grid
             #Iterate front to back, building layers
             qs.new_layer()
-            input_layer = self.grid[0]
             unresolved_inputs = []
-            new_unresolved_inputs = []
+            #Each layer is keyed by the operator keys of its nodes (see ZXNode.operator_key), so that compile can reuse the products of
+            #blocks of layers this individual shares with its parent (see QSystem.compile_run_cached)
+            layer_key = []
 
             #Iterate over each input, generating a matrix for it
             for input in range(self.i):
-                node = input_layer[input]
-
-                #All inputs use 1 input
-                inputs = 1
-
                 #Find active outputs, add them to unresolved_inputs and increase the count of outputs for this node
                 outputs = 0
-                for output in range(node.get_outputs_size()):
-                    if node.get_output(output) is not None:
-                        #An output using a connection has been found. It is now checked to see if its source is active
-                        potential_output = node.get_output(output)
-                        if self.get_node(potential_output.get_x(), potential_output.get_y()).get_active():
-                            unresolved_inputs.append(potential_output)
-                            outputs += 1
-
-                #Calculate Matrix for input. Input is always green with phase 0.0 e.g. a wire for 1 output
-                qs.add_operator(node.calculate_operator(inputs, outputs))
-                
+                for slot in range(input * r, (input + 1) * r):
+                    target = out_edges[slot]
+                    if target >= 0 and active[target // a] == 1:
+                        unresolved_inputs.append(target)
+                        outputs += 1
+
+                #Calculate Matrix for input. Input is always green with phase 0.0 e.g. a wire for 1 output. All inputs use 1 input
+                qs.add_operator(self.get_node_by_id(input).calculate_operator(1, outputs))
+                layer_key.append(ZXNode.operator_key(genome.function_of(input), genome.phase[input], 1, outputs, genome.controlled[input] == 1))
+
             #Close the input layer
-            qs.close_layer()
+            qs.close_layer(tuple(layer_key))
 
-            #Iterate through each hidden layer
-            for l in range(self.n):
-                #Reset the new unresolved inputs list
-                new_unresolved_inputs = []
+            #Iterate through each hidden layer, then the output layer
+            for layer_index in range(1, self.n + 2):
+                #Wire position of each edge not yet matched to a node in this layer
+                positions = {}
+                for k in range(len(unresolved_inputs)):
+                    positions[unresolved_inputs[k]] = k
 
-                #List to store which inputs have been matched to which vertical index in the quantum system
+                #Edges matched to a node in this layer in the order their qubits leave it, and the edges leaving it
                 resolved_inputs = []
-
-                #Start a new layer
+                new_unresolved_inputs = []
+                layer_key = []
                 qs.new_layer()
 
-                #input layer is index 0 so shuffle index one to right
-                layer_index = l + 1
-                found_node = False
-
-                #Go through each hidden node in this layer
-                for j in range(self.m):
-                    #Get jth corresponding node
-                    node = self.get_node(layer_index, j)
-
-                    found_node = True
+                for j in range(genome.layer_size(layer_index)):
+                    node = genome.node_id(layer_index, j)
                     #A node is only relevant if its has already been tagged active
-                    if node.get_active():
-                        inputs = 0
+                    if active[node] == 0:
+                        continue
+                    #It is possible for a node to be active with no active inputs. This would make the node a generator, see ZXNode.py
+                    #Inputs are matched in slot order to maintain a clear ordering on the inputs and outputs
+                    inputs = 0
+                    for slot in range(node * a, (node * a) + genome.input_count(node)):
+                        if positions.pop(slot, None) is not None:
+                            resolved_inputs.append(slot)
+                            inputs += 1
+
+                    if layer_index == self.n + 1:
+                        #All output nodes have 1 output
+                        outputs = 1
+                    else:
+                        #Find active outputs. Since the node is active there should always be at least 1
                         outputs = 0
-                        #Try to find some edge connecting to this node by searching over all unresolved edges. It is possible for a node to be active with no active inputs
-                        #This would make the node a generator, but this behaviour is accommodated for and can be seen in ZXNode.py, in the ZXNode class, calculate_matrix() method
-                        #We split the process into matching for individual inputs for the node. The purpose of doing this is to maintain a clear ordering on
-                        #The inputs and outputs.
-                        for e in range(node.get_inputs_size()):
-                            for k in range(len(unresolved_inputs)):
-                                #Get kth edge
-                                input = unresolved_inputs[k]
-
-                                #Check if kth edge has coordinates matching this node
-                                if input.get_x() == node.get_x() and input.get_y() == node.get_y() and e == input.get_z():
-                                    #Matching edge. Store the match as a resolved input and increase inputs counter
-                                    resolved_inputs.append(input)
-                                    inputs += 1
-
-                        #Try to find active outputs. Note, since the node is active there should always be at least 1 active output
-                        for k in range(node.get_outputs_size()):
-                            #Get kth output
-                            output = node.get_output(k)
-
-                            #Check if the output is an active connection
-                            if output is not None and self.get_node(output.get_x(), output.get_y()).get_active():
-                                #New output. Store the new output as an unresolved input and increase outputs counter
-                                new_unresolved_inputs.append(output)
+                        for slot in range(node * r, (node + 1) * r):
+                            target = out_edges[slot]
+                            if target >= 0 and active[target // a] == 1:
+                                new_unresolved_inputs.append(target)
                                 outputs += 1
 
                         #Spit out a warning if there is a node with no active outputs
                         if outputs == 0:
                             print("Warning! CGP execution with active node with no active outputs!")
 
-                        #We know now the complexity of the node, so can build a matrix representation and add it to the system
-                        qs.add_operator(node.calculate_operator(inputs, outputs))
-
-                #Only build the layer if an operator has been added
-
-                if found_node:
-                    #There may be edges that were not matched to a node in this layer. If the CGP representation is correctly coded these will all be
-                    #Edges anticipated in future layers
-                    for i in range(len(unresolved_inputs)):
-                        #Get ith unresolved input
-                        unresolved = unresolved_inputs[i]
-
-                        #Have we matched this input?
-                        already_matched = False
-                        for j in range(len(resolved_inputs)):
-                            #Get jth resolved input
-                            resolved = resolved_inputs[j]
-                            if unresolved.get_x() == resolved.get_x() and unresolved.get_y() == resolved.get_y() and unresolved.get_z() == resolved.get_z():
-                                already_matched = True
-
-                        #When we know that the ith input has not been resolved, we push that input to the bottom of the system, transition it with
-                        #a wire operator and insert it into the new unresolved inputs list on the other side of the layer, e.g. resolve this later
-                        if not already_matched:
-                            #If the unresolved input has an x coordinate that indicates it should have been resolved by now e.g.
-                            #Existed in an earlier layer than this, spit out a warning
-                            if unresolved.get_x() < layer_index:
+                    #We know now the complexity of the node, so can build a matrix representation and add it to the system
+                    qs.add_operator(self.get_node_by_id(node).calculate_operator(inputs, outputs))
+                    layer_key.append(ZXNode.operator_key(genome.function_of(node), genome.phase[node], inputs, outputs, genome.controlled[node] == 1))
+
+                #Edges that were not matched to a node in this layer are anticipated in future layers. Each is pushed to the bottom of the
+                #system with a wire operator and resolved later
+                if layer_index <= self.n:
+                    for unresolved in unresolved_inputs:
+                        if unresolved in positions:
+                            #If the edge points to a node in an earlier layer than this, spit out a warning
+                            if genome.node_x(unresolved // a) < layer_index:
                                 print("Warning! Unresolved connection points to node that should already be resolved!")
-                            #Wire has form (1, 0), (0, 1) e.g. 2x2 identity Matrix
-                            qs.add_operator(CMatrix([[1 + 0j, 0 + 0j],[0 + 0j, 1 + 0j]]))
+                            #Wire is the 2x2 identity Matrix. It is skipped when the layer is applied
+                            qs.add_operator(IdentityMatrix(1))
+                            layer_key.append("W")
                             resolved_inputs.append(unresolved)
                             new_unresolved_inputs.append(unresolved)
 
-                    #A new qubit may have been generated. A connection matrix is only necessary when qubits previously existed.
-
-                    if len(unresolved_inputs) > 0:
-                        #Close, adding a newly generated connection matrix (that reorders qubits so that they are passed from correct output to correct input
-                        qs.close_layer_with_connection_matrix(self.calculate_connection_matrix(unresolved_inputs, resolved_inputs))
-                    else:
-                        qs.close_layer()
+                #A new qubit may have been generated. A connection matrix is only necessary when qubits previously existed.
+                if len(unresolved_inputs) > 0:
+                    #Close, adding a newly generated connection matrix (that reorders qubits so that they are passed from correct output to correct input
+                    connection = self.calculate_connection_matrix(unresolved_inputs, resolved_inputs)
+                    qs.close_layer_with_connection_matrix(connection, tuple(layer_key), ("P", tuple(connection.axes)))
+                else:
+                    qs.close_layer(tuple(layer_key))
 
                 #Update unresolved_inputs
                 unresolved_inputs = new_unresolved_inputs
 
-            #Build output layer
-            # Go through each output node in this layer
-
-            #List to store which inputs have been matched to which vertical index in the quantum system
-            resolved_inputs = []
+            #Compile the system
+            qs.compile(states)
+            return qs
 
-            #Start a new layer
+        #Gets the active graph as a ZX diagram, free of the grid (see ZX_Diagram.py)
+        def get_diagram(self):
+            return ZX_Diagram.from_zx_cgp(self)
+
+        #Alternative to generate_qsystem which contracts the diagram as a tensor network (see ZX_Diagram.evaluate) rather than building a
+        #layer spanning every live wire at each column of the grid. The system holds the resulting operator as its single layer
+        #If a ZX_Simplifier is given the diagram is simplified first (see ZX_Simplifier.py). The rewritten diagram has no grid positions,
+        #which is why simplification is only available to this evaluator
+        #If clifford, a diagram whose phases are all multiples of pi / 2 is evaluated as a stabilizer sum in polynomial time (see
+        #StabilizerSum.py), falling back to contraction when a node is not Clifford. Only the internal legs are summed in polynomial time, the
+        #operator over the boundary legs being dense. Clifford evaluation is opt-in through the builder's "clifford" evaluator
+        #If states, the number of states the system is going to be applied to, is given then a contracted diagram is not evaluated as a full
+        #operator but kept as a DiagramMatrix, which contracts it with the states it is applied to (see ZX_Diagram.py)
+        def generate_qsystem_tn(self, simplifier=None, clifford=False, states=None):
+            diagram = self.get_diagram()
+            if simplifier is not None:
+                simplifier.simplify(diagram)
+            stabilizer = None
+            if clifford:
+                stabilizer = Stabilizer_Sum.from_zx_diagram(diagram)
+            qs = QSystem()
             qs.new_layer()
-
-            for j in range(self.o):
-                # Get jth corresponding node
-                node = self.get_node(self.n + 1, j)
-
-                found_node = True
-                inputs = 0
-
-                #All output nodes have 1 output
-                outputs = 1
-
-                # Try to find some edge connecting to this node by searching over all unresolved edges. It is possible for a node to be active with no active inputs
-                # This would make the node a generator, but this behaviour is accommodated for and can be seen in ZXNode.py, in the ZXNode class, calculate_matrix() method
-                # We split the process into matching for individual inputs for the node. The purpose of doing this is to maintain a clear ordering on
-                # The inputs and outputs.
-                for e in range(node.get_inputs_size()):
-                    for k in range(len(unresolved_inputs)):
-                        # Get kth edge
-                        input = unresolved_inputs[k]
-
-                        # Check if kth edge has coordinates matching this node
-                        if input.get_x() == node.get_x() and input.get_y() == node.get_y() and e == input.get_z():
-                            # Matching edge. Store the match as a resolved input and increase inputs counter
-                            resolved_inputs.append(input)
-                            inputs += 1
-
-                # We know now the complexity of the node, so can build a matrix representation and add it to the system
-                qs.add_operator(node.calculate_operator(inputs, outputs))
-            if len(unresolved_inputs) != 0:
-                qs.close_layer_with_connection_matrix(self.calculate_connection_matrix(unresolved_inputs, resolved_inputs))
+            if stabilizer is None and states is not None:
+                qs.add_operator(DiagramMatrix(diagram))
+            elif stabilizer is None:
+                qs.add_operator(diagram.evaluate())
             else:
-                qs.close_layer()
-
-
-            #Compile the system
+                qs.add_operator(CMatrix.from_array(stabilizer.to_array()))
+            qs.close_layer()
             qs.compile()
             return qs
 
-        #Recalculates which nodes in the individual are active by sweeping backwards from the outputs.
-        #Code largely based on check_complexity method in this module
-        def active_pass(self):
-            #Initially, set all nodes (except outputs) to inactive. This is to ensure no nodes which are not active are
-            #Left active from the previous evaluation
-            for x in range(self.n):
-                    for y in range(self.m):
-                            self.grid[x + 1][y].set_active(False)
-
-            #Inputs are initially inactive too
-            for i in range(self.i):
-                    self.grid[0][i].set_active(False)
-            
-            active = []
-            #Get our initial output connections from the outputs
-            for o in self.grid[self.n + 1]:
-                #Outputs are always active
-                o.set_active(True)
-                for input in range(o.get_inputs_size()):
-                    inp = o.get_input(input)
-                    if inp is not None:
-                        active.append(inp)
-
-            #If active is bigger than the max complexity, then the check fails
-            if len(active) > self.c:
+        #Checks the incrementally maintained active flags and counters against a full recalculation (active_pass), printing a warning
+        #and keeping the recalculated values if they differ. Returns whether they matched
+        def verify_active_set(self):
+            genome = self.genome
+            maintained = [genome.active[:], genome.fan_in[:], genome.fan_out[:], genome.widths[:], genome.over_cap]
+            self.active_pass()
+            if maintained != [genome.active, genome.fan_in, genome.fan_out, genome.widths, genome.over_cap]:
+                print("Warning! Incrementally maintained active set differs from a full active pass!")
                 return False
+            return True
 
-            l = self.n + 1
-            #Iterate from back to front, layer by layer, removing nodes that are present from the active list and adding their inputs
-            while l > 0:
-                l = l - 1
-                active_nodes = []
-                new_active = []
-                #Check every currently considered node to see if it is in this layer
-                for node in active:
-                    #y coordinate check
-                    if node.get_x() == l:
-                        #Node is found in this layer. Add it to active nodes
-                        active_nodes.append(node)
-                    else:
-                        #Node is not found in this layer. Add it to new_active so that it is checked next layer
-                        new_active.append(node)
-
-                #Iterate through every active node in this layer, removing duplicates and adding children to new active so that they are checked next layer
-
-                #To remove duplicates create a string list to abuse python's set function with
-                string_active = []
-                for a in active_nodes:
-                    string_active.append(str(a.get_x()) + ":" + str(a.get_y()))
-                reduced = list(set(string_active))
-                #Use this set to induce active elements created by active nodes in this layer
-                for a in reduced:
-                    sp = a.split(":")
-                    x = sp[0]
-                    y = sp[1]
-                    anode = self.get_node(int(x), int(y))
-                    
-                    for i in range(anode.get_inputs_size()):
-                        if anode.get_input(i) is not None:
-                            new_active.append(anode.get_input(i))
-                    #Mark the active node
-                    anode.set_active(True)
-                #Copy new active list over
-                active = new_active
-
-        #Takes two lists, in and out, which are assumed to be two orderings on the same set of EdgePointers
-        #Returns a connection matrix that maps each qubit state to its transformed state to provide the implied set of swaps
+        #Recalculates which nodes in the individual are active by sweeping backwards from the outputs, along with the fan in and fan out counters.
+        #Mutations keep these up to date, so this is only needed after editing nodes directly (e.g. ZXNodeView.set_input) or for debugging
+        def active_pass(self):
+            self.genome.recalculate_active()
+            self.phenotype = None
+
+        #Takes two lists, in and out, which are assumed to be two orderings on the same set of edges, given either as EdgePointers or as
+        #edge codes (see generate_qsystem)
+        #Returns a connection matrix that moves each qubit to its position in the out list to provide the implied set of swaps
         def calculate_connection_matrix(self, inE, outE):
             if len(inE) != len(outE):
                 #Lists should be equal size, else the connection matrix is incorrect
                 print("Warning! generating connection matrix of mismatched size:" + str(inE) + " vs. " + str(outE))
                 print(self)
-            size = int(math.pow(2, len(inE)))
 
-            #Initiate connection matrix as zeros
-            cm = [[0 + 0j for i in range(size)] for j in range(size)]
+            #Index each edge of the out list by its position. The found position is the index mapping for that qubit
+            out_positions = {}
+            for j in range(len(outE)):
+                key = ZX_CGP.edge_key(outE[j])
+                if key in out_positions:
+                    #Second match! Provided inputs are flawed
+                    print("Warning! the provided input, " + str(outE[j]) + ", was found twice or more in the output.")
+                    print(self)
+                else:
+                    out_positions[key] = j
 
             #Build bit transformation. This provides the index mapping for each qubit in the system
             bittrans = [0 for i in range(len(inE))]
-
-            #Cycle in each edge pointer, trying to find its match in the out. The found match is the index mapping for that qubit
             for i in range(len(inE)):
-                un = inE[i]
-                #print("Check " + str(i) + ": " + str(un))
-                found = False
-                for j in range(len(outE)):
-                    re = outE[j]
-                    #print("Against " + str(j) + ": " + str(re))
-                    #Check if this is a match
-                    if un.get_x() == re.get_x() and un.get_y() == re.get_y() and un.get_z() == re.get_z():
-                        #We have found a match
-                        if found:
-                            #Second match! Provided inputs are flawed
-                            print("Warning! the provided input, " + str(un) + ", was found twice or more in the output.")
-                            print(self)
-                        else:
-                            bittrans[i] = j
-                            found = True
-                    #else:
-                    #    print("Fail")
-                if not found:
+                j = out_positions.get(ZX_CGP.edge_key(inE[i]))
+                if j is None:
                     #This qubit has no out match, Provided inputs are flawed
-                    print("Warning! the provided input, " + str(un) + ", was not found in the output.")
-            #Bit transformation contructed. Now iterate through bit form of each index
-            #print(bittrans)
-
-            #Now each state maps to the state generated by applying the bit transformation to it
-            #Cycle through each state
-            for state in range(size):
-
-                #Converts state to bit state, a bitstring array
-                bstate = list("{0:b}".format(state))
-
-                #Ensures the bstate is the expected length (for smaller values)
-                while len(bstate) < len(inE):
-                    bstate = ["0"] + bstate
-
-                #Transform the bit state using the transformation
-                newstate = ["0"] * len(inE)
-
-                #Map each bit
-                for bit in range(len(inE)):
-                    newstate[bittrans[bit]] = bstate[bit]
-
-                #Convert the bitstring array, newstate, into an integer using base 2 formatting
-                nstate = int(''.join(map(str, newstate)), 2)
-                #Store this change in the connection matrix
-                cm[state][nstate] = 1 + 0j
-            return CMatrix(cm)
+                    print("Warning! the provided input, " + str(inE[i]) + ", was not found in the output.")
+                else:
+                    bittrans[i] = j
+            #Bit transformation contructed. The connection is the qubit permutation itself (see QubitPermutationMatrix in StructuredMatrix.py),
+            #which reorders the axes of a state rather than mapping each basis state
+            return QubitPermutationMatrix(bittrans)
+
+        #Hashable key of an edge given as an EdgePointer or an edge code
+        @staticmethod
+        def edge_key(e):
+            if isinstance(e, EPointer):
+                return (e.get_x(), e.get_y(), e.get_z())
+            return e
 
 
 
@@ -0,0 +1,147 @@
+from ZXNode import *
+from TensorNetwork import *
+import numpy as np
+#A vertex of a ZX_Diagram: a node's function, phase and control flag with its ordered input and output legs, each leg being an edge label
+class ZX_Vertex:
+    def __init__(self, function, phase, controlled, inputs, outputs):
+        self.function = function
+        self.phase = phase
+        self.controlled = controlled
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+    #Operator of the vertex, shared with ZXNode (see ZXNode.operator)
+    def get_operator(self):
+        return ZXNode.operator(self.function, self.phase, len(self.inputs), len(self.outputs), self.controlled)
+
+    #The operator as a tensor with one axis per leg, output legs first, most significant qubit first
+    def get_tensor(self):
+        return self.get_operator().to_array().reshape([2] * (len(self.outputs) + len(self.inputs)))
+
+    def __str__(self):
+        return self.function + " " + str(self.phase) + (" C-GATE" if self.controlled else "") + ": " + str(self.inputs) + " -> " + str(self.outputs)
+
+#The active graph of a ZX_CGP individual as a ZX diagram, free of the grid. Edges are integer labels shared by the two legs they join,
+#and the circuit's inputs and outputs are the labels of the open legs, in qubit order
+#Each vertex has the operator its node would have in generate_qsystem, so evaluating the diagram gives the same operator as the layered system
+class ZX_Diagram:
+    def __init__(self):
+        self.vertices = []
+        self.inputs = []
+        self.outputs = []
+        self.edges = 0
+
+    #Gets a new edge label
+    def new_edge(self):
+        self.edges += 1
+        return self.edges - 1
+
+    def add_vertex(self, vertex):
+        self.vertices.append(vertex)
+        return vertex
+
+    def get_vertices(self):
+        return self.vertices
+
+    def get_inputs(self):
+        return self.inputs
+
+    def get_outputs(self):
+        return self.outputs
+
+    #Extracts the diagram of the active nodes of a ZX_CGP individual. Inputs and outputs of nodes are taken in slot order, counting only
+    #edges into active nodes, as generate_qsystem does. Every input node is included, an inactive input closing its qubit
+    @staticmethod
+    def from_zx_cgp(zx):
+        genome = zx.get_genome()
+        active = genome.active
+        in_edges = genome.in_edges
+        out_edges = genome.out_edges
+        a = genome.a
+        r = genome.r
+        diagram = ZX_Diagram()
+        #Edges between nodes are labelled in the order their input slot codes are met
+        labels = {}
+        for node in range(genome.size):
+            if active[node] == 0 and node >= genome.i:
+                continue
+            inputs = []
+            if node < genome.i:
+                label = diagram.new_edge()
+                diagram.inputs.append(label)
+                inputs.append(label)
+            else:
+                for slot in range(node * a, (node * a) + genome.input_count(node)):
+                    if in_edges[slot] >= 0:
+                        inputs.append(ZX_Diagram.edge_label(diagram, labels, slot))
+            outputs = []
+            if node >= genome.first_output():
+                label = diagram.new_edge()
+                diagram.outputs.append(label)
+                outputs.append(label)
+            else:
+                for slot in range(node * r, (node + 1) * r):
+                    target = out_edges[slot]
+                    if target >= 0 and active[target // a] == 1:
+                        outputs.append(ZX_Diagram.edge_label(diagram, labels, target))
+            diagram.add_vertex(ZX_Vertex(genome.function_of(node), genome.phase[node], genome.controlled[node] == 1, inputs, outputs))
+        return diagram
+
+    @staticmethod
+    def edge_label(diagram, labels, slot):
+        label = labels.get(slot)
+        if label is None:
+            label = diagram.new_edge()
+            labels[slot] = label
+        return label
+
+    #Builds the tensor network of the diagram. If states, a (2^inputs, k) ndarray of k column vectors, is given it is attached to the
+    #input legs with its columns on an extra leg, labelled -1
+    def tensor_network(self, states=None):
+        network = Tensor_Network()
+        for v in self.vertices:
+            network.add_tensor(v.get_tensor(), v.outputs + v.inputs)
+        if states is not None:
+            network.add_tensor(states.reshape([2] * len(self.inputs) + [states.shape[1]]), self.inputs + [-1])
+        return network
+
+    #Estimated multiply-adds to evaluate the diagram, as the full operator or applied to states
+    def contraction_cost(self, states=None):
+        return self.tensor_network(states).contraction_cost()
+
+    #Evaluates the diagram by contracting its tensor network (see TensorNetwork.py)
+    #Returns the full (2^outputs, 2^inputs) operator as a CMatrix, or if states is given the (2^outputs, k) ndarray of the operator applied to them
+    def evaluate(self, states=None):
+        network = self.tensor_network(states)
+        if states is None:
+            result = network.contract(self.outputs + self.inputs)
+            return CMatrix.from_array(result.reshape(1 << len(self.outputs), 1 << len(self.inputs)))
+        result = network.contract(self.outputs + [-1])
+        return result.reshape(1 << len(self.outputs), states.shape[1])
+
+    def __str__(self):
+        s = "Inputs: " + str(self.inputs) + "\nOutputs: " + str(self.outputs)
+        for v in self.vertices:
+            s += "\n" + str(v)
+        return s
+
+#The operator of a ZX_Diagram, applied to states by contracting the diagram with them (see ZX_Diagram.evaluate) rather than through the
+#full operator. Applying it to k states takes memory of order 2^n * k rather than the 4^n of the operator, so wide circuits can be scored
+#on their checks. The dense operator is only built if something asks for it
+class DiagramMatrix(StructuredMatrix):
+    def __init__(self, diagram):
+        StructuredMatrix.__init__(self)
+        self.diagram = diagram
+
+    def get_shape(self):
+        return (1 << len(self.diagram.outputs), 1 << len(self.diagram.inputs))
+
+    def build_array(self):
+        return self.diagram.evaluate().to_array()
+
+    def apply_array(self, v):
+        return self.diagram.evaluate(v)
+
+    #The cost depends only on the shape of the states, so the network is costed with an unfilled array
+    def apply_cost(self, columns):
+        return self.diagram.contraction_cost(np.empty((self.get_shape()[1], columns), dtype=np.complex128))
@@ -0,0 +1,395 @@
+from ZXNode import *
+from EdgePointer import *
+from array import array
+#Flat, typed-array storage for the nodes and edges of a ZX_CGP grid, so that copying an individual is a handful of memcpys rather
+#than rebuilding hundreds of ZXNode and EPointer objects
+#Every node has an integer id: the i inputs first, then the m nodes of each of the n hidden layers in order, then the o outputs
+#Edges are stored from both of their ends, -1 meaning unconnected:
+#in_edges[node * a + slot] = source * r + source output slot
+#out_edges[source * r + slot] = node * a + node input slot
+#Activity is maintained as edges change: fan_in counts the connected inputs of each node and fan_out counts the edges from each node
+#into active nodes. A node other than an output is active exactly when its fan_out is positive, so connecting or disconnecting an edge
+#only walks the cone of nodes whose activity changes
+#The edges into active nodes are also counted at every cut of the grid they cross (see cut_widths), so the widest cut can be checked
+#against a width cap without walking the graph: over_cap counts the cuts wider than cap
+class ZX_Genome:
+    #Function codes used in the function array
+    Functions = [ZXNode.Function_Set.G, ZXNode.Function_Set.R, ZXNode.Function_Set.H]
+    Function_Codes = {ZXNode.Function_Set.G: 0, ZXNode.Function_Set.R: 1, ZXNode.Function_Set.H: 2}
+
+    #Params are as for ZX_CGP: inputs, layers, layer width, outputs, max input arity and max output arity, then the width cap (the
+    #complexity limit c of ZX_CGP), None for no cap
+    def __init__(self, i, n, m, o, a, r, cap=None):
+        self.i = i
+        self.n = n
+        self.m = m
+        self.o = o
+        self.a = a
+        self.r = r
+        self.size = i + (n * m) + o
+        #All nodes start as inactive green nodes with phase 0
+        self.function = array('b', bytes(self.size))
+        self.phase = array('d', bytes(8 * self.size))
+        self.controlled = array('b', bytes(self.size))
+        self.active = array('b', bytes(self.size))
+        self.in_edges = array('i', [-1]) * (self.size * a)
+        self.out_edges = array('i', [-1]) * (self.size * r)
+        self.fan_in = array('i', [0]) * self.size
+        self.fan_out = array('i', [0]) * self.size
+        #Live edges at each cut, as returned by cut_widths, and the number of cuts wider than cap
+        self.cap = cap
+        self.widths = array('i', [0]) * (n + 2)
+        self.over_cap = 0
+        #Visited markers for walk_active, kept clear between walks
+        self.marks = bytearray(self.size)
+        #Outputs are inherently active
+        for output in range(o):
+            self.active[self.first_output() + output] = 1
+
+    #Copies every array
+    def copy(self):
+        new = ZX_Genome.__new__(ZX_Genome)
+        new.i = self.i
+        new.n = self.n
+        new.m = self.m
+        new.o = self.o
+        new.a = self.a
+        new.r = self.r
+        new.size = self.size
+        new.function = self.function[:]
+        new.phase = self.phase[:]
+        new.controlled = self.controlled[:]
+        new.active = self.active[:]
+        new.in_edges = self.in_edges[:]
+        new.out_edges = self.out_edges[:]
+        new.fan_in = self.fan_in[:]
+        new.fan_out = self.fan_out[:]
+        new.cap = self.cap
+        new.widths = self.widths[:]
+        new.over_cap = self.over_cap
+        new.marks = bytearray(self.size)
+        return new
+
+    #Function of a node, as a ZXNode.Function_Set value
+    def function_of(self, node):
+        return ZX_Genome.Functions[self.function[node]]
+
+    #Id of the first output node
+    def first_output(self):
+        return self.i + (self.n * self.m)
+
+    #Id of the node at grid coordinate (x, y), layer 0 being the inputs and layer n + 1 the outputs
+    def node_id(self, x, y):
+        if x == 0:
+            return y
+        if x <= self.n:
+            return self.i + ((x - 1) * self.m) + y
+        return self.first_output() + y
+
+    #Layer (x coordinate) of a node
+    def node_x(self, node):
+        if node < self.i:
+            return 0
+        if node < self.first_output():
+            return ((node - self.i) // self.m) + 1
+        return self.n + 1
+
+    #Position within its layer (y coordinate) of a node
+    def node_y(self, node):
+        if node < self.i:
+            return node
+        if node < self.first_output():
+            return (node - self.i) % self.m
+        return node - self.first_output()
+
+    #Number of nodes in layer x
+    def layer_size(self, x):
+        if x == 0:
+            return self.i
+        if x <= self.n:
+            return self.m
+        return self.o
+
+    #Number of input slots of a node. Inputs have none and outputs have 1
+    def input_count(self, node):
+        if node < self.i:
+            return 0
+        if node < self.first_output():
+            return self.a
+        return 1
+
+    #Number of output slots of a node. Outputs have none
+    def output_count(self, node):
+        if node < self.first_output():
+            return self.r
+        return 0
+
+    #Slot code of input slot index of a node, as stored in out_edges
+    def input_slot(self, node, index):
+        return (node * self.a) + index
+
+    #Slot code of output slot index of a node, as stored in in_edges
+    def output_slot(self, node, index):
+        return (node * self.r) + index
+
+    #Connects an output slot to an input slot. Any edges already using either slot are disconnected
+    def connect(self, out_slot, in_slot):
+        if self.out_edges[out_slot] == in_slot:
+            return
+        source = out_slot // self.r
+        target = in_slot // self.a
+        #The new edge is counted before the old edges are removed so that a cone shared by both is not deactivated and reactivated
+        self.fan_in[target] += 1
+        if self.active[target] == 1:
+            self.use(source, target)
+        old_target = self.out_edges[out_slot]
+        if old_target >= 0:
+            self.remove_edge(out_slot, old_target)
+        old_source = self.in_edges[in_slot]
+        if old_source >= 0:
+            self.remove_edge(old_source, in_slot)
+        self.in_edges[in_slot] = out_slot
+        self.out_edges[out_slot] = in_slot
+
+    #Disconnects the edge into an input slot, if any. Returns the output slot the edge came from, or -1
+    def disconnect(self, in_slot):
+        source = self.in_edges[in_slot]
+        if source >= 0:
+            self.remove_edge(source, in_slot)
+        return source
+
+    #Removes the edge between an output slot and an input slot, updating the counters
+    def remove_edge(self, out_slot, in_slot):
+        self.in_edges[in_slot] = -1
+        self.out_edges[out_slot] = -1
+        target = in_slot // self.a
+        self.fan_in[target] -= 1
+        if self.active[target] == 1:
+            self.release(out_slot // self.r, target)
+
+    #Counts a new edge from a node into an active target, activating the node and its inputs' cone if it was inactive
+    def use(self, node, target):
+        self.fan_out[node] += 1
+        self.count_wire(node, target, 1)
+        if self.fan_out[node] > 1:
+            return
+        a = self.a
+        worklist = [node]
+        while len(worklist) > 0:
+            node = worklist.pop()
+            self.active[node] = 1
+            for slot in range(node * a, (node * a) + self.input_count(node)):
+                source = self.in_edges[slot]
+                if source >= 0:
+                    source = source // self.r
+                    self.fan_out[source] += 1
+                    self.count_wire(source, node, 1)
+                    if self.fan_out[source] == 1:
+                        worklist.append(source)
+
+    #Uncounts an edge from a node into an active target, deactivating the node and its inputs' cone if that was its last one
+    def release(self, node, target):
+        self.fan_out[node] -= 1
+        self.count_wire(node, target, -1)
+        if self.fan_out[node] > 0:
+            return
+        a = self.a
+        worklist = [node]
+        while len(worklist) > 0:
+            node = worklist.pop()
+            self.active[node] = 0
+            for slot in range(node * a, (node * a) + self.input_count(node)):
+                source = self.in_edges[slot]
+                if source >= 0:
+                    source = source // self.r
+                    self.fan_out[source] -= 1
+                    self.count_wire(source, node, -1)
+                    if self.fan_out[source] == 0:
+                        worklist.append(source)
+
+    #Sets the width cap, recounting the cuts wider than it
+    def set_cap(self, cap):
+        self.cap = cap
+        self.over_cap = 0
+        if cap is not None:
+            for width in self.widths:
+                if width > cap:
+                    self.over_cap += 1
+
+    #Adds change (1 or -1) to the width of every cut crossed by an edge from source to target, keeping over_cap up to date
+    def count_wire(self, source, target, change):
+        widths = self.widths
+        cap = self.cap
+        for cut in range(self.node_x(source) + 1, self.node_x(target) + 1):
+            width = widths[cut] + change
+            widths[cut] = width
+            if cap is not None:
+                if change > 0 and width == cap + 1:
+                    self.over_cap += 1
+                elif change < 0 and width == cap:
+                    self.over_cap -= 1
+
+    #Reverse topological walk from the outputs. Returns the ids of every node reachable from an output through input edges in decreasing
+    #id order, so each node comes after every reached node it feeds. Nodes are marked visited in a bytearray which is cleared afterwards
+    def walk_active(self):
+        marks = self.marks
+        in_edges = self.in_edges
+        a = self.a
+        r = self.r
+        worklist = list(range(self.first_output(), self.size))
+        reached = list(worklist)
+        for node in worklist:
+            marks[node] = 1
+        while len(worklist) > 0:
+            node = worklist.pop()
+            base = node * a
+            for slot in range(base, base + self.input_count(node)):
+                source = in_edges[slot]
+                if source >= 0:
+                    source = source // r
+                    if marks[source] == 0:
+                        marks[source] = 1
+                        reached.append(source)
+                        worklist.append(source)
+        for node in reached:
+            marks[node] = 0
+        reached.sort(reverse=True)
+        return reached
+
+    #Recalculates the active flags and counters from scratch using walk_active
+    def recalculate_active(self):
+        for node in range(self.size):
+            self.active[node] = 0
+        for node in self.walk_active():
+            self.active[node] = 1
+        self.count_fans()
+
+    #Number of edges crossing each cut of the grid when only the given nodes are kept, e.g. the walk_active nodes. Cut l lies between
+    #layers l - 1 and l, and an edge crosses every cut from just after its source's layer up to its target's layer. The returned list is
+    #indexed by cut, from 0 (always empty) to n + 1
+    def cut_widths(self, nodes):
+        a = self.a
+        r = self.r
+        changes = [0] * (self.n + 3)
+        for node in nodes:
+            x = self.node_x(node)
+            base = node * a
+            for slot in range(base, base + self.input_count(node)):
+                source = self.in_edges[slot]
+                if source >= 0:
+                    changes[self.node_x(source // r) + 1] += 1
+                    changes[x + 1] -= 1
+        widths = [0] * (self.n + 2)
+        width = 0
+        for l in range(self.n + 2):
+            width += changes[l]
+            widths[l] = width
+        return widths
+
+    #Recalculates fan_in, fan_out and the cut widths from the edges and active flags, e.g. after the active flags have been recalculated
+    #from scratch
+    def count_fans(self):
+        a = self.a
+        r = self.r
+        for node in range(self.size):
+            self.fan_in[node] = 0
+            self.fan_out[node] = 0
+        for cut in range(self.n + 2):
+            self.widths[cut] = 0
+        self.over_cap = 0
+        for node in range(self.size):
+            for slot in range(node * a, (node * a) + self.input_count(node)):
+                source = self.in_edges[slot]
+                if source >= 0:
+                    self.fan_in[node] += 1
+                    if self.active[node] == 1:
+                        self.fan_out[source // r] += 1
+                        self.count_wire(source // r, node, 1)
+
+    #Converts an edge code to an EPointer, given the stride (a for in_edges codes, r for out_edges codes)
+    def edge_pointer(self, code, stride):
+        if code < 0:
+            return None
+        node = code // stride
+        return EPointer(self.node_x(node), self.node_y(node), code % stride)
+
+    #Converts an EPointer to an edge code, given the stride
+    def edge_code(self, pointer, stride):
+        if pointer is None:
+            return -1
+        return (self.node_id(pointer.get_x(), pointer.get_y()) * stride) + pointer.get_z()
+
+#A ZXNode whose state lives in a ZX_Genome, so the ZXNode API (see ZXNode.py) can be used on array-backed individuals
+#Views are cheap and hold nothing but the genome and the node's id
+#set_input and set_output only write one end of an edge and do not update activity, so after editing a genome through views
+#ZX_CGP.active_pass must be called (see ZX_CGP.py). Mutations use ZX_Genome.connect and disconnect instead
+class ZXNodeView(ZXNode):
+    def __init__(self, genome, node):
+        self.genome = genome
+        self.id = node
+        self.x = genome.node_x(node)
+        self.y = genome.node_y(node)
+        self.a = genome.input_count(node)
+        self.r = genome.output_count(node)
+
+    def get_id(self):
+        return self.id
+
+    @property
+    def function(self):
+        return self.genome.function_of(self.id)
+
+    @function.setter
+    def function(self, new_function):
+        self.genome.function[self.id] = ZX_Genome.Function_Codes[new_function]
+
+    @property
+    def phase(self):
+        return self.genome.phase[self.id]
+
+    @phase.setter
+    def phase(self, new_phase):
+        self.genome.phase[self.id] = new_phase
+
+    @property
+    def controlled(self):
+        return self.genome.controlled[self.id] == 1
+
+    @controlled.setter
+    def controlled(self, c):
+        self.genome.controlled[self.id] = 1 if c else 0
+
+    @property
+    def active(self):
+        return self.genome.active[self.id] == 1
+
+    @active.setter
+    def active(self, new_active):
+        self.genome.active[self.id] = 1 if new_active else 0
+
+    @property
+    def inputs(self):
+        return [self.get_input(i) for i in range(self.a)]
+
+    @property
+    def outputs(self):
+        return [self.get_output(o) for o in range(self.r)]
+
+    def count_active_inputs(self):
+        return self.genome.fan_in[self.id]
+
+    #Number of outputs of the node connected to active nodes
+    def count_active_outputs(self):
+        return self.genome.fan_out[self.id]
+
+    def get_input(self, index):
+        return self.genome.edge_pointer(self.genome.in_edges[(self.id * self.genome.a) + index], self.genome.r)
+
+    def get_output(self, index):
+        return self.genome.edge_pointer(self.genome.out_edges[(self.id * self.genome.r) + index], self.genome.a)
+
+    def set_input(self, input_index, input_node):
+        self.genome.in_edges[(self.id * self.genome.a) + input_index] = self.genome.edge_code(input_node, self.genome.r)
+
+    def set_output(self, output_index, output_node):
+        self.genome.out_edges[(self.id * self.genome.r) + output_index] = self.genome.edge_code(output_node, self.genome.a)
@@ -0,0 +1,187 @@
+from ZX_Diagram import *
+#Simplifies a ZX_Diagram (see ZX_Diagram.py) with the standard rewrite rules, so that less has to be contracted when it is evaluated:
+#identity removal: a 0 phase green or red spider with 1 input and 1 output is a wire
+#Hadamard cancellation: two Hadamard gates (1 input, 1 output Hadamard nodes) in a row are a wire
+#spider fusion: spiders of the same colour sharing edges merge into one spider, adding phases and dropping the shared edges
+#colour change: a spider with Hadamard gates on most of its legs changes colour, swapping those Hadamards for ones on its other legs
+#Every rule keeps the operator exactly, given the node semantics of ZXNode.py. Green spiders with inputs and outputs are |0...0><0...0| +
+#e^(i * phase) |1...1><1...1| whichever legs are inputs, and red spiders are the same with a Hadamard on every leg, so those fuse by adding
+#phases. Generators and destructors (no inputs or no outputs) hold cos and sin weights instead, so they only take part in colour changes, and
+#controlled nodes are left alone. Rewrites which would join a vertex to itself are skipped
+#Statistics on the rules applied and the vertices removed are totalled over every diagram simplified
+class ZX_Simplifier:
+    Statistics = ["diagrams", "vertices_before", "vertices_after", "identities", "hadamard_pairs", "fusions", "colour_changes"]
+
+    def __init__(self):
+        self.statistics = {}
+        for s in ZX_Simplifier.Statistics:
+            self.statistics[s] = 0
+
+    #Gets a copy of the statistics
+    def get_statistics(self):
+        return dict(self.statistics)
+
+    #Simplifies a diagram in place, returning it. Rules are applied one at a time until none apply
+    def simplify(self, diagram):
+        self.statistics["diagrams"] += 1
+        self.statistics["vertices_before"] += len(diagram.vertices)
+        applied = True
+        while applied:
+            applied = False
+            ends = ZX_Simplifier.edge_ends(diagram)
+            for v in diagram.vertices:
+                if ZX_Simplifier.is_identity(v) and self.remove_identity(diagram, ends, v):
+                    applied = True
+                    break
+                if ZX_Simplifier.is_hadamard_gate(v) and self.cancel_hadamards(diagram, ends, v):
+                    applied = True
+                    break
+                if ZX_Simplifier.is_general_spider(v) and self.fuse(diagram, ends, v):
+                    applied = True
+                    break
+                if ZX_Simplifier.is_spider(v) and self.change_colour(diagram, ends, v):
+                    applied = True
+                    break
+        self.statistics["vertices_after"] += len(diagram.vertices)
+        return diagram
+
+    #Vertices using each edge label
+    @staticmethod
+    def edge_ends(diagram):
+        ends = {}
+        for v in diagram.vertices:
+            for label in v.inputs + v.outputs:
+                ends.setdefault(label, []).append(v)
+        return ends
+
+    #Vertex at the other end of an edge from v, or None for an open leg of the diagram
+    @staticmethod
+    def other_end(ends, label, v):
+        for u in ends.get(label, []):
+            if u is not v:
+                return u
+        return None
+
+    #Whether a vertex acts as a green or red spider, e.g. is not a Hadamard or an effective controlled node (see ZXNode.operator_key)
+    @staticmethod
+    def is_spider(v):
+        if v.function is ZXNode.Function_Set.H:
+            return False
+        return not (v.controlled and len(v.inputs) == len(v.outputs) and len(v.inputs) != 1)
+
+    #Whether a vertex is a spider with inputs and outputs, whose legs are then interchangeable
+    @staticmethod
+    def is_general_spider(v):
+        return ZX_Simplifier.is_spider(v) and len(v.inputs) > 0 and len(v.outputs) > 0
+
+    @staticmethod
+    def is_identity(v):
+        return ZX_Simplifier.is_spider(v) and len(v.inputs) == 1 and len(v.outputs) == 1 and ZXNode.quantise_phase(v.phase) == 0.0
+
+    @staticmethod
+    def is_hadamard_gate(v):
+        return v.function is ZXNode.Function_Set.H and len(v.inputs) == 1 and len(v.outputs) == 1
+
+    #Renames an edge label wherever it is used
+    @staticmethod
+    def rename(diagram, ends, old, new):
+        for u in ends.get(old, []):
+            u.inputs = [new if l == old else l for l in u.inputs]
+            u.outputs = [new if l == old else l for l in u.outputs]
+        diagram.inputs = [new if l == old else l for l in diagram.inputs]
+        diagram.outputs = [new if l == old else l for l in diagram.outputs]
+
+    #Removes the vertices listed, joining edge before to edge after, e.g. when they form a wire. Fails if the join would connect an open
+    #leg straight to another or a vertex to itself
+    @staticmethod
+    def join(diagram, ends, removed, before, after):
+        first = ZX_Simplifier.other_end(ends, before, removed[0])
+        last = ZX_Simplifier.other_end(ends, after, removed[-1])
+        if first is None and last is None:
+            return False
+        if first is not None and first is last:
+            return False
+        for v in removed:
+            diagram.vertices.remove(v)
+        ZX_Simplifier.rename(diagram, ends, after, before)
+        return True
+
+    def remove_identity(self, diagram, ends, v):
+        if ZX_Simplifier.join(diagram, ends, [v], v.inputs[0], v.outputs[0]):
+            self.statistics["identities"] += 1
+            return True
+        return False
+
+    def cancel_hadamards(self, diagram, ends, v):
+        u = ZX_Simplifier.other_end(ends, v.outputs[0], v)
+        if u is None or not ZX_Simplifier.is_hadamard_gate(u):
+            return False
+        if ZX_Simplifier.join(diagram, ends, [v, u], v.inputs[0], u.outputs[0]):
+            self.statistics["hadamard_pairs"] += 1
+            return True
+        return False
+
+    #Fuses v with the first neighbouring spider of the same colour that leaves a spider with at least 2 legs
+    def fuse(self, diagram, ends, v):
+        for label in v.inputs + v.outputs:
+            u = ZX_Simplifier.other_end(ends, label, v)
+            if u is None or u.function is not v.function or not ZX_Simplifier.is_general_spider(u):
+                continue
+            shared = set(v.inputs + v.outputs) & set(u.inputs + u.outputs)
+            inputs = [l for l in v.inputs + u.inputs if l not in shared]
+            outputs = [l for l in v.outputs + u.outputs if l not in shared]
+            if len(inputs) + len(outputs) < 2:
+                continue
+            #Legs are interchangeable, but the fused spider must keep both inputs and outputs
+            if len(inputs) == 0:
+                inputs.append(outputs.pop(0))
+            if len(outputs) == 0:
+                outputs.append(inputs.pop())
+            fused = ZX_Vertex(v.function, v.phase + u.phase, False, inputs, outputs)
+            diagram.vertices[diagram.vertices.index(v)] = fused
+            diagram.vertices.remove(u)
+            self.statistics["fusions"] += 1
+            return True
+        return False
+
+    #Changes the colour of v if more of its legs lead to Hadamard gates than not
+    def change_colour(self, diagram, ends, v):
+        legs = v.inputs + v.outputs
+        hadamards = {}
+        for label in legs:
+            u = ZX_Simplifier.other_end(ends, label, v)
+            if u is not None and ZX_Simplifier.is_hadamard_gate(u):
+                other = u.outputs[0] if u.inputs[0] == label else u.inputs[0]
+                #The Hadamard must not lead back to v
+                if ZX_Simplifier.other_end(ends, other, u) is not v:
+                    hadamards[label] = [u, other]
+        if 2 * len(hadamards) <= len(legs):
+            return False
+        inputs = []
+        outputs = []
+        for side, new_side in [[v.inputs, inputs], [v.outputs, outputs]]:
+            for label in side:
+                if label in hadamards:
+                    #Absorb the Hadamard, taking over its other edge
+                    u, other = hadamards[label]
+                    diagram.vertices.remove(u)
+                    new_side.append(other)
+                else:
+                    #Put a Hadamard on the leg
+                    new = diagram.new_edge()
+                    if side is v.inputs:
+                        diagram.vertices.append(ZX_Vertex(ZXNode.Function_Set.H, 0.0, False, [label], [new]))
+                    else:
+                        diagram.vertices.append(ZX_Vertex(ZXNode.Function_Set.H, 0.0, False, [new], [label]))
+                    new_side.append(new)
+        function = ZXNode.Function_Set.R if v.function is ZXNode.Function_Set.G else ZXNode.Function_Set.G
+        diagram.vertices[diagram.vertices.index(v)] = ZX_Vertex(function, v.phase, v.controlled, inputs, outputs)
+        self.statistics["colour_changes"] += 1
+        return True
+
+    def __str__(self):
+        s = "ZX simplifier: "
+        for name in ZX_Simplifier.Statistics:
+            s += name + " " + str(self.statistics[name]) + ", "
+        removed = self.statistics["vertices_before"] - self.statistics["vertices_after"]
+        return s + "vertices removed " + str(removed)